@@ -1,4 +1,4 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import (
     HOME_DIR,
     PKG_DIR,
@@ -8,10 +8,11 @@ from libdotfiles.util import (
     run,
 )
 
-try_install("alsa-utils")
-try_install("pulseaudio")
-try_install("pulseaudio-bluetooth")
-try_install("pavucontrol")
+with batched():
+    try_install("alsa-utils")
+    try_install("pulseaudio")
+    try_install("pulseaudio-bluetooth")
+    try_install("pavucontrol")
 
 copy_file(
     PKG_DIR / "audio-sources.yml", HOME_DIR / ".config/audio-sources.yml"
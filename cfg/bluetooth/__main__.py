@@ -1,9 +1,10 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import run
 
-try_install("bluez")
-try_install("bluez-utils")
-try_install("blueman")
+with batched():
+    try_install("bluez")
+    try_install("bluez-utils")
+    try_install("blueman")
 
 run(["sudo", "systemctl", "enable", "bluetooth"])
 run(["sudo", "systemctl", "start", "bluetooth"])
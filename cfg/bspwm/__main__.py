@@ -1,13 +1,14 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import HOME_DIR, PKG_DIR, create_symlinks
 
-try_install("bspwm")
-try_install("dmenu")  # program executor
-try_install("feh")  # wallpaper renderer
-try_install("i3lock")  # lock screen
-try_install("arc-gtk-theme")  # dark GTK theme
-try_install("dunst")  # notification manager
-try_install("xfconf")  # toggle-high-dpi
+with batched():
+    try_install("bspwm")
+    try_install("dmenu")  # program executor
+    try_install("feh")  # wallpaper renderer
+    try_install("i3lock")  # lock screen
+    try_install("arc-gtk-theme")  # dark GTK theme
+    try_install("dunst")  # notification manager
+    try_install("xfconf")  # toggle-high-dpi
 
 create_symlinks(
     [
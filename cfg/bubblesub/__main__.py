@@ -1,17 +1,18 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import get_distro_name
 
-if get_distro_name() == "arch":
-    try_install("python-pyqt5")
-    try_install("ffms2-git")
-    try_install("fftw")
-elif get_distro_name() == "linuxmint":
-    try_install("python3-setuptools")
-    try_install("python3-pip")
-    try_install("wheel", method="pip")
-    try_install("python3-dev")
-    try_install("python3-pyqt5")
-    try_install("libffms2-4")
-    try_install("libfftw3-bin")
-    try_install("libmpv-dev")
-    try_install("libass-dev")
+with batched():
+    if get_distro_name() == "arch":
+        try_install("python-pyqt5")
+        try_install("ffms2-git")
+        try_install("fftw")
+    elif get_distro_name() == "linuxmint":
+        try_install("python3-setuptools")
+        try_install("python3-pip")
+        try_install("wheel", method="pip")
+        try_install("python3-dev")
+        try_install("python3-pyqt5")
+        try_install("libffms2-4")
+        try_install("libfftw3-bin")
+        try_install("libmpv-dev")
+        try_install("libass-dev")
@@ -1,11 +1,12 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import HOME_DIR, PKG_DIR, create_symlinks
 
-try_install("fcitx5")
-try_install("fcitx5-anthy")
-try_install("fcitx5-configtool")
-try_install("fcitx5-qt")
-try_install("fcitx5-gtk")
+with batched():
+    try_install("fcitx5")
+    try_install("fcitx5-anthy")
+    try_install("fcitx5-configtool")
+    try_install("fcitx5-qt")
+    try_install("fcitx5-gtk")
 
 create_symlinks(
     [
@@ -1,6 +1,6 @@
 from pathlib import Path
 
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import (
     HOME_DIR,
     PKG_DIR,
@@ -12,21 +12,22 @@ from libdotfiles.util import (
     run,
 )
 
-if get_distro_name() == "arch":
-    try_install("ttf-dejavu")
-    try_install("ttf-ms-fonts")
-    try_install("ttf-ipa-mona")
-    try_install("adobe-source-han-sans-otc-fonts")
-    try_install("adobe-source-han-serif-otc-fonts")
-    try_install("noto-fonts")  # for fallback unicode characters
-    try_install("noto-fonts-emoji")  # for emoji in the terminal
-else:
-    try_install("xfonts-utils")
-    try_install("fonts-ipafont")
-    try_install("fonts-dejavu")
-    try_install("fonts-symbola")
-    try_install("fonts-font-awesome")
-    try_install("fonts-monapo")
+with batched():
+    if get_distro_name() == "arch":
+        try_install("ttf-dejavu")
+        try_install("ttf-ms-fonts")
+        try_install("ttf-ipa-mona")
+        try_install("adobe-source-han-sans-otc-fonts")
+        try_install("adobe-source-han-serif-otc-fonts")
+        try_install("noto-fonts")  # for fallback unicode characters
+        try_install("noto-fonts-emoji")  # for emoji in the terminal
+    else:
+        try_install("xfonts-utils")
+        try_install("fonts-ipafont")
+        try_install("fonts-dejavu")
+        try_install("fonts-symbola")
+        try_install("fonts-font-awesome")
+        try_install("fonts-monapo")
 
 if Path("/usr/share/fonts").exists():
     fonts_dir = HOME_DIR / ".local" / "share" / "fonts"
@@ -1,9 +1,10 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import HOME_DIR, PKG_DIR, create_symlinks
 
-try_install("git")
-try_install("git-extras")
-try_install("github-cli")
+with batched():
+    try_install("git")
+    try_install("git-extras")
+    try_install("github-cli")
 
 # to generate a new key: gpg --full-generate-key
 
@@ -22,7 +22,10 @@ def setup_ubuntu_mpr() -> None:
 
     if not list_path.exists():
         arch = run(
-            ["dpkg", "--print-architecture"], capture_output=True, text=True
+            ["dpkg", "--print-architecture"],
+            exclusive=False,
+            capture_output=True,
+            text=True,
         ).stdout.strip()
         lsb_release = run(
             ["lsb_release", "-cs"], capture_output=True, text=True
@@ -0,0 +1,4 @@
+# the colors it sources are rendered by theme(1)
+DEPENDS = ["theme"]
+# PlugInstall opens an editor
+INTERACTIVE = True
@@ -1,4 +1,4 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import (
     HOME_DIR,
     PKG_DIR,
@@ -6,7 +6,7 @@ from libdotfiles.util import (
     create_file,
     create_symlink,
     create_symlinks,
-    download_file,
+    download_files,
     get_distro_name,
     run,
 )
@@ -14,17 +14,18 @@ from libdotfiles.util import (
 NVIM_DIR = HOME_DIR / ".config" / "nvim"
 NVIM_SPELL_DIR = NVIM_DIR / "spell"
 
-if get_distro_name() == "arch":
-    try_install("neovim")
-    try_install("pynvim", method="pip")
-elif get_distro_name() == "linuxmint":
-    try_install("neovim")
-    try_install("python3-neovim")
-elif get_distro_name() == "ubuntu":
-    try_install("neovim")
-    try_install("pynvim", method="pip")
-try_install("black", method="pip")
-try_install("isort", method="pip")
+with batched():
+    if get_distro_name() == "arch":
+        try_install("neovim")
+        try_install("pynvim", method="pip")
+    elif get_distro_name() == "linuxmint":
+        try_install("neovim")
+        try_install("python3-neovim")
+    elif get_distro_name() == "ubuntu":
+        try_install("neovim")
+        try_install("pynvim", method="pip")
+    try_install("black", method="pip")
+    try_install("isort", method="pip")
 
 for dirname in ["undo", "backup", "swap", "spell"]:
     create_dir(NVIM_DIR / dirname)
@@ -42,17 +43,21 @@ create_symlinks(
 
 create_symlink(PKG_DIR / "editorconfig", HOME_DIR / ".editorconfig")
 
-download_file(
-    "ftp://ftp.vim.org/pub/vim/runtime/spell/en.utf-8.spl",
-    NVIM_SPELL_DIR / "en.utf-8.spl",
-)
-download_file(
-    "ftp://ftp.vim.org/pub/vim/runtime/spell/pl.utf-8.spl",
-    NVIM_SPELL_DIR / "pl.utf-8.spl",
-)
-download_file(
-    "https://raw.githubusercontent.com/junegunn/vim-plug/master/plug.vim",
-    NVIM_DIR / "autoload" / "plug.vim",
+download_files(
+    [
+        (
+            "ftp://ftp.vim.org/pub/vim/runtime/spell/en.utf-8.spl",
+            NVIM_SPELL_DIR / "en.utf-8.spl",
+        ),
+        (
+            "ftp://ftp.vim.org/pub/vim/runtime/spell/pl.utf-8.spl",
+            NVIM_SPELL_DIR / "pl.utf-8.spl",
+        ),
+        (
+            "https://raw.githubusercontent.com/junegunn/vim-plug/master/plug.vim",
+            NVIM_DIR / "autoload" / "plug.vim",
+        ),
+    ]
 )
 create_file(
     HOME_DIR / ".config" / "zsh" / "editor.sh",
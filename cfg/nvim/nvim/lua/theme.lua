@@ -127,6 +127,60 @@ apply_highlights()
 -- fires before it.
 vim.api.nvim_create_autocmd('ColorScheme', { callback = apply_highlights })
 
+-- `theme --daemon`, when it runs, says so down a socket instead, and leaves
+-- the editors that listen out of its rpc calls. See cfg/theme/daemon.py.
+local function subscribe_to_daemon()
+  local uv = vim.uv or vim.loop
+  local runtime_dir = vim.env.XDG_RUNTIME_DIR
+  if not runtime_dir or runtime_dir == '' then
+    runtime_dir = '/tmp/dotfiles-' .. uv.getuid()
+  end
+  -- anybody may make /tmp/dotfiles-<uid> first and listen in it, so only a
+  -- directory of ours that nobody else can get into - what daemon.py checks
+  for _, dir in ipairs({ runtime_dir, runtime_dir .. '/dotfiles' }) do
+    local stat = uv.fs_lstat(dir)
+    if not stat or stat.type ~= 'directory' or stat.uid ~= uv.getuid() or stat.mode % 64 ~= 0 then
+      return
+    end
+  end
+  local path = runtime_dir .. '/dotfiles/theme.sock'
+  if not uv.fs_stat(path) then
+    return
+  end
+  -- not from inside the callbacks, which may not touch vim.v
+  local hello = 'subscribe nvim ' .. vim.v.servername .. '\n'
+  local pipe = uv.new_pipe(false)
+  local pending = ''
+  pipe:connect(path, function(err)
+    if err then
+      pipe:close()
+      return
+    end
+    pipe:write(hello)
+    pipe:read_start(function(read_err, data)
+      if read_err or not data then
+        pipe:close()
+        return
+      end
+      pending = pending .. data
+      while true do
+        local newline = pending:find('\n', 1, true)
+        if not newline then
+          break
+        end
+        local theme = pending:sub(1, newline - 1)
+        pending = pending:sub(newline + 1)
+        vim.schedule(function()
+          if (theme == 'dark' or theme == 'light') and vim.o.background ~= theme then
+            vim.o.background = theme
+          end
+        end)
+      end
+    end)
+  end)
+end
+subscribe_to_daemon()
+
 vim.o.cursorline = true
 vim.o.statusline = '%f %m%r%=Col:%c Line:%l/%L'
 vim.g.c_no_curly_error = 1  -- breaks in the simplest __VA_ARGS__ macros
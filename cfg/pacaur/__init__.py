@@ -0,0 +1,2 @@
+# makepkg -i asks before installing what it built
+INTERACTIVE = True
@@ -1,23 +1,24 @@
 import os
 import tempfile
 
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import get_distro_name, run
 
 if get_distro_name() == "arch":
-    try_install("patch")
-    try_install("expac")
-    try_install("fakechroot")
-    try_install("fakeroot")
-    try_install("gtest")
-    try_install("jq")
-    try_install("gcc")
-    try_install("debugedit")
-    try_install("pkgconfig")
-    try_install("make")
-    try_install("meson")
-    try_install("sudo")
-    try_install("glaze")
+    with batched():
+        try_install("patch")
+        try_install("expac")
+        try_install("fakechroot")
+        try_install("fakeroot")
+        try_install("gtest")
+        try_install("jq")
+        try_install("gcc")
+        try_install("debugedit")
+        try_install("pkgconfig")
+        try_install("make")
+        try_install("meson")
+        try_install("sudo")
+        try_install("glaze")
 
     with tempfile.TemporaryDirectory() as tmp_dir:
         os.chdir(tmp_dir)
@@ -4,6 +4,7 @@ from libdotfiles.util import (
     PKG_DIR,
     create_symlink,
     get_distro_name,
+    git_clone,
     run,
 )
 
@@ -25,17 +26,7 @@ elif get_distro_name() == "linuxmint":
         )
         run(["sudo", "dpkg", "-i", "ripgrep_11.0.2_amd64.deb"], check=True)
 
-    run(
-        [
-            "git",
-            "clone",
-            "--depth",
-            "1",
-            "https://github.com/junegunn/fzf.git",
-            FZF_DIR,
-        ],
-        check=True,
-    )
+    git_clone("https://github.com/junegunn/fzf.git", FZF_DIR, depth=1)
     run(
         [
             FZF_DIR / "install",
@@ -1,9 +1,10 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import HOME_DIR, PKG_DIR, create_symlinks
 
-try_install("sxhkd")
-try_install("xdo")
-try_install("wmctrl")
+with batched():
+    try_install("sxhkd")
+    try_install("xdo")
+    try_install("wmctrl")
 
 create_symlinks(
     [
@@ -0,0 +1,3 @@
+# render.generate() renders every template under cfg, whoever's it is, with
+# the colors wezterm's palettes define
+INPUTS = ["**/*.tmpl", "wezterm/colors/*.toml"]
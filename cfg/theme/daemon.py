@@ -0,0 +1,168 @@
+"""An optional resident theme(1), and a channel it tells consumers on.
+
+Without it, a switch finds every consumer that is running and pokes each in
+its own way: a WINCH for every zsh, an RPC call to every nvim, a batch for
+every tmux server. With `theme --daemon` running, zsh and nvim subscribe to
+it over a Unix socket instead - see cfg/zsh/zshrc and
+cfg/nvim/nvim/lua/theme.lua - and `theme dark` only asks the daemon to do
+the switch. The daemon writes a line to every subscriber and pokes only
+what didn't subscribe, so a switch costs about the same however many shells
+and editors are open.
+
+A line each way. A client sends one of:
+
+    subscribe <who>   and gets the theme now, then a line per switch
+    switch <theme>    and gets a line per consumer that had trouble, then
+                      `done`, or `error <why>` if the switch didn't happen
+    get               and gets the theme now
+
+<who> is `zsh <pid>` or `nvim <servername>`, which is how the daemon knows
+not to poke that shell or editor as well.
+"""
+
+import asyncio
+import signal
+import socket
+from pathlib import Path
+
+from cfg.theme.render import THEMES, current_theme
+from libdotfiles.launcher import is_private, make_socket_dir, runtime_dir
+
+SOCKET_PATH = runtime_dir() / "dotfiles" / "theme.sock"
+# a whole switch, its notifiers' deadline included, with room to spare
+REQUEST_TIMEOUT = 15.0
+# bytes a subscriber may leave unread before it is dropped
+MAX_BACKLOG = 4096
+
+
+def request(
+    line: str,
+    socket_path: Path = SOCKET_PATH,
+    timeout: float = REQUEST_TIMEOUT,
+) -> list[str] | None:
+    """One request to the daemon and its reply; None if there's no daemon.
+
+    Plain blocking sockets: this is all `theme` does when a daemon runs.
+    A socket somebody else could have put there is no daemon of ours.
+    """
+    if not is_private(socket_path.parent.parent, socket_path.parent):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        with client:
+            client.connect(str(socket_path))
+            client.sendall(line.encode() + b"\n")
+            chunks = []
+            while chunk := client.recv(65536):
+                chunks.append(chunk)
+    except OSError:
+        return None  # none running, or one that died on us
+    return b"".join(chunks).decode(errors="replace").splitlines()
+
+
+class Daemon:
+    def __init__(self) -> None:
+        self.theme = current_theme()
+        self.subscribers: dict[asyncio.StreamWriter, str] = {}
+        # two switches at once would race each other through every consumer
+        self.lock = asyncio.Lock()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            words = (await reader.readline()).decode(errors="replace").split()
+            if words[:1] == ["subscribe"]:
+                await self.subscribe(reader, writer, " ".join(words[1:]))
+            elif (
+                len(words) == 2 and words[0] == "switch" and words[1] in THEMES
+            ):
+                for line in await self.switch(words[1]):
+                    writer.write(line.encode() + b"\n")
+            elif words == ["get"]:
+                writer.write(self.theme.encode() + b"\n")
+            else:
+                writer.write(b"error unknown request\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def subscribe(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        who: str,
+    ) -> None:
+        writer.write(self.theme.encode() + b"\n")
+        self.subscribers[writer] = who
+        try:
+            # nothing else is coming; this only waits for the subscriber to go
+            while await reader.read(4096):
+                pass
+        finally:
+            self.subscribers.pop(writer, None)
+
+    async def switch(self, theme: str) -> list[str]:
+        from cfg.theme import switch, timing
+
+        async with self.lock:
+            try:
+                with timing.timed(theme, "daemon"):
+                    switch.prepare(theme)
+                    self.theme = theme
+                    lines = self.publish(theme)
+                    consumers = switch.consumers(
+                        theme, self.subscribers.values()
+                    )
+                    outcomes = await switch.notify(consumers)
+            except Exception as ex:
+                return [f"error {ex}"]
+            return [*lines, *switch.report(outcomes), "done"]
+
+    def publish(self, theme: str) -> list[str]:
+        """Tell every subscriber; the lines are about the ones dropped."""
+        lines = []
+        for writer, who in list(self.subscribers.items()):
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                lines.append(f"{who}: stopped reading, dropped")
+                del self.subscribers[writer]
+                writer.close()
+                continue
+            writer.write(theme.encode() + b"\n")
+        return lines
+
+
+async def serve(socket_path: Path = SOCKET_PATH) -> None:
+    make_socket_dir(socket_path)
+    if request("get", socket_path, timeout=1) is not None:
+        raise RuntimeError(f"a daemon is listening on {socket_path} already")
+    socket_path.unlink(missing_ok=True)
+    daemon = Daemon()
+    server = await asyncio.start_unix_server(daemon.handle, str(socket_path))
+    inode = socket_path.stat().st_ino
+    task = asyncio.current_task()
+    assert task is not None
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        # another daemon may have taken the path over since we bound it
+        try:
+            if socket_path.stat().st_ino == inode:
+                socket_path.unlink()
+        except OSError:
+            pass
+
+
+def run() -> None:
+    """serve() until SIGTERM or ^C."""
+    try:
+        asyncio.run(serve())
+    except RuntimeError as ex:
+        raise SystemExit(f"theme: {ex}") from None
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,228 @@
+"""Tell a running nvim something over its socket, without starting another.
+
+`nvim --headless --server <socket> --remote-expr` is a whole nvim, started
+for every instance running, to send one command. What it sends is a
+msgpack-RPC request, and nvim_command is all the theme needs from the API, so
+this speaks just enough msgpack to ask for it and read the answer.
+
+A socket file outlives an nvim that crashed; nobody accepts on it any more,
+so connecting fails at once and the socket is skipped.
+"""
+
+import asyncio
+import itertools
+import struct
+from pathlib import Path
+from typing import Any
+
+# connecting to a local socket is instant or it is never going to happen
+CONNECT_TIMEOUT = 0.5
+# nvim answers between two keystrokes, unless it is stuck in something
+REPLY_TIMEOUT = 2.0
+
+REQUEST = 0
+RESPONSE = 1
+
+_message_ids = itertools.count()
+
+
+class Incomplete(ValueError):
+    """The bytes so far end in the middle of a value."""
+
+
+def pack(value: Any) -> bytes:
+    """msgpack for the handful of types a request is made of."""
+    if value is None:
+        return b"\xc0"
+    if value is True:
+        return b"\xc3"
+    if value is False:
+        return b"\xc2"
+    if isinstance(value, int):
+        if 0 <= value < 0x80:
+            return bytes([value])
+        if -32 <= value < 0:
+            return struct.pack("b", value)
+        if 0 <= value < 2**32:
+            return b"\xce" + struct.pack("!I", value)
+        return b"\xd3" + struct.pack("!q", value)
+    if isinstance(value, str):
+        data = value.encode()
+        if len(data) < 32:
+            return bytes([0xA0 | len(data)]) + data
+        return b"\xdb" + struct.pack("!I", len(data)) + data
+    if isinstance(value, bytes):
+        return b"\xc6" + struct.pack("!I", len(value)) + value
+    if isinstance(value, (list, tuple)):
+        head = (
+            bytes([0x90 | len(value)])
+            if len(value) < 16
+            else b"\xdd" + struct.pack("!I", len(value))
+        )
+        return head + b"".join(pack(item) for item in value)
+    if isinstance(value, dict):
+        head = (
+            bytes([0x80 | len(value)])
+            if len(value) < 16
+            else b"\xdf" + struct.pack("!I", len(value))
+        )
+        return head + b"".join(
+            pack(key) + pack(item) for key, item in value.items()
+        )
+    raise TypeError(f"can't pack {type(value).__name__}")
+
+
+# type byte -> struct format, for the fixed-size scalars
+_SCALARS = {
+    0xCA: "!f",
+    0xCB: "!d",
+    0xCC: "!B",
+    0xCD: "!H",
+    0xCE: "!I",
+    0xCF: "!Q",
+    0xD0: "!b",
+    0xD1: "!h",
+    0xD2: "!i",
+    0xD3: "!q",
+}
+# type byte -> size of the length that follows it
+_STR = {0xD9: 1, 0xDA: 2, 0xDB: 4}
+_BIN = {0xC4: 1, 0xC5: 2, 0xC6: 4}
+_EXT = {0xC7: 1, 0xC8: 2, 0xC9: 4}
+_FIXEXT = {0xD4: 1, 0xD5: 2, 0xD6: 4, 0xD7: 8, 0xD8: 16}
+_ARRAY = {0xDC: 2, 0xDD: 4}
+_MAP = {0xDE: 2, 0xDF: 4}
+_LENGTHS = {1: "!B", 2: "!H", 4: "!I"}
+
+
+def unpack(data: bytes, offset: int = 0) -> tuple[Any, int]:
+    """One value out of data at offset, and the offset after it.
+
+    Any msgpack nvim may send: ext values, which is how it sends buffer and
+    window handles, come back as (type, bytes) pairs.
+    """
+
+    def take(size: int) -> bytes:
+        nonlocal offset
+        if offset + size > len(data):
+            raise Incomplete
+        chunk = data[offset : offset + size]
+        offset += size
+        return chunk
+
+    def length(size: int) -> int:
+        value: int = struct.unpack(_LENGTHS[size], take(size))[0]
+        return value
+
+    (kind,) = take(1)
+    if kind < 0x80:
+        return kind, offset
+    if kind >= 0xE0:
+        return kind - 0x100, offset
+    if 0xA0 <= kind < 0xC0:
+        return take(kind & 0x1F).decode(errors="replace"), offset
+    if 0x90 <= kind < 0xA0 or kind in _ARRAY:
+        count = kind & 0x0F if kind < 0xA0 else length(_ARRAY[kind])
+        items = []
+        for _ in range(count):
+            item, offset = unpack(data, offset)
+            items.append(item)
+        return items, offset
+    if 0x80 <= kind < 0x90 or kind in _MAP:
+        count = kind & 0x0F if kind < 0x90 else length(_MAP[kind])
+        mapping = {}
+        for _ in range(count):
+            key, offset = unpack(data, offset)
+            mapping[key], offset = unpack(data, offset)
+        return mapping, offset
+    if kind == 0xC0:
+        return None, offset
+    if kind in (0xC2, 0xC3):
+        return kind == 0xC3, offset
+    if kind in _SCALARS:
+        fmt = _SCALARS[kind]
+        return struct.unpack(fmt, take(struct.calcsize(fmt)))[0], offset
+    if kind in _STR:
+        return take(length(_STR[kind])).decode(errors="replace"), offset
+    if kind in _BIN:
+        return take(length(_BIN[kind])), offset
+    if kind in _EXT or kind in _FIXEXT:
+        size = _FIXEXT[kind] if kind in _FIXEXT else length(_EXT[kind])
+        (ext_type,) = struct.unpack("!b", take(1))
+        return (ext_type, take(size)), offset
+    raise ValueError(f"not msgpack: type byte {kind:#x}")
+
+
+async def connect(
+    socket: Path,
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter] | None:
+    """A connection to the nvim at socket, or None if it's long gone."""
+    try:
+        return await asyncio.wait_for(
+            asyncio.open_unix_connection(str(socket)), CONNECT_TIMEOUT
+        )
+    except (OSError, TimeoutError):
+        return None
+
+
+async def call(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    method: str,
+    *args: Any,
+    timeout: float = REPLY_TIMEOUT,
+) -> Any:
+    """One API call over a connection, and its result.
+
+    RuntimeError if nvim says the call failed, TimeoutError if it says
+    nothing in time.
+    """
+    message_id = next(_message_ids) & 0xFFFFFFFF
+    writer.write(pack([REQUEST, message_id, method, list(args)]))
+    await writer.drain()
+    try:
+        return await asyncio.wait_for(_read_reply(reader, message_id), timeout)
+    except TimeoutError:
+        raise TimeoutError(f"no answer within {timeout:g} s") from None
+
+
+async def command(
+    socket: Path, text: str, timeout: float = REPLY_TIMEOUT
+) -> bool:
+    """Run an Ex command in the nvim at socket; False if nobody is there."""
+    connection = await connect(socket)
+    if connection is None:
+        return False
+    reader, writer = connection
+    try:
+        await call(reader, writer, "nvim_command", text, timeout=timeout)
+    finally:
+        writer.close()
+    return True
+
+
+async def _read_reply(reader: asyncio.StreamReader, message_id: int) -> Any:
+    buffer = b""
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            raise ConnectionError("nvim hung up before answering")
+        buffer += chunk
+        while buffer:
+            try:
+                message, offset = unpack(buffer)
+            except Incomplete:
+                break
+            buffer = buffer[offset:]
+            # notifications and requests of nvim's own are none of ours
+            if (
+                isinstance(message, list)
+                and len(message) == 4
+                and message[:2] == [RESPONSE, message_id]
+            ):
+                error, result = message[2], message[3]
+                if error is not None:
+                    if isinstance(error, list) and len(error) == 2:
+                        error = error[1]
+                    raise RuntimeError(str(error))
+                return result
@@ -12,17 +12,21 @@ stops inheriting whatever the terminal booted with.
 """
 
 import os
+import selectors
+import time
 from pathlib import Path
-from subprocess import TimeoutExpired, run
 
+from cfg.theme import tmux
 from cfg.theme.render import (
     THEME_DIR,
     THEMES,
-    Role,
-    load_palette,
-    load_roles,
+    Manifest,
+    input_hashes,
+    input_key,
+    load_theme,
     to_rgb,
 )
+from libdotfiles import trace
 
 OSC = "\033]"
 # BEL rather than ST: every terminal that takes OSC at all takes BEL, and it
@@ -36,16 +40,20 @@ BATCH = 16
 # the terminal's cursor, from the role nvim already paints its own with
 CURSOR_ROLE = "editor.cursor_bg"
 
+# a few KB on a pty: a terminal that can't take them in this long is behind
+# a stalled link, or not reading its pty at all
+WRITE_TIMEOUT = 1.0
+
 
 def x_color(color: str) -> str:
     """#rrggbb is legal in an OSC, but rgb:rr/gg/bb is what X means."""
     return "rgb:%02x/%02x/%02x" % to_rgb(color)
 
 
-def payload(theme: str) -> str:
+def payload(theme: str, target_dir: Path = THEME_DIR) -> str:
     """The whole palette as escapes: 256 indices, fg, bg, cursor."""
-    palette = load_palette(theme)
-    roles: dict[str, Role] = load_roles()
+    snapshot = load_theme(theme, target_dir)
+    palette = snapshot.palette
     indices = sorted(key for key in palette if isinstance(key, int))
 
     pieces = []
@@ -57,8 +65,8 @@ def payload(theme: str) -> str:
         pieces.append(f"{OSC}4;{body}{BEL}")
     pieces.append(f"{OSC}10;{x_color(palette['fg'])}{BEL}")
     pieces.append(f"{OSC}11;{x_color(palette['bg'])}{BEL}")
-    if CURSOR_ROLE in roles:
-        cursor = x_color(roles[CURSOR_ROLE].color(theme))
+    if CURSOR_ROLE in snapshot.colors:
+        cursor = x_color(snapshot.colors[CURSOR_ROLE])
         pieces.append(f"{OSC}12;{cursor}{BEL}")
     return "".join(pieces)
 
@@ -73,25 +81,15 @@ def through_tmux(text: str) -> str:
     return "\033Ptmux;" + text.replace("\033", "\033\033") + "\033\\"
 
 
-def terminals() -> list[str]:
+def terminals(clients: list[str] | None = None) -> list[str]:
     """Every tty a repaint should land on.
 
     Never a tmux pane's own tty: writing there hands the bytes to tmux, which
     parses them instead of passing them on. An attached client's tty is the ssh
     pty itself, so the escapes reach the terminal with nobody in between.
+    Pass clients if a tmux batch listed them already.
     """
-    ttys: list[str] = []
-    try:
-        clients = run(
-            ["tmux", "list-clients", "-F", "#{client_tty}"],
-            capture_output=True,
-            text=True,
-            timeout=5,
-            check=False,
-        )
-        ttys.extend(clients.stdout.split())
-    except (OSError, TimeoutExpired):
-        pass  # no tmux on this machine, or no server running
+    ttys = list(tmux.client_ttys() if clients is None else clients)
     if "TMUX" not in os.environ:
         for fd in (1, 2):
             try:
@@ -102,23 +100,100 @@ def terminals() -> list[str]:
     return list(dict.fromkeys(ttys))
 
 
-def repaint(theme: str) -> None:
-    """Push the palette at every terminal we can reach right now."""
-    text = payload(theme)
-    for tty in terminals():
+def write_all(
+    ttys: list[str], data: bytes, timeout: float = WRITE_TIMEOUT
+) -> dict[str, str]:
+    """Write data to every tty side by side, and give up on any at timeout.
+
+    Each tty is opened non-blocking, so a full pty buffer means a partial
+    write and a wait in select() alongside the others, rather than a write()
+    that never returns. What comes back is why each tty that didn't take all
+    of data didn't.
+    """
+    with trace.span("write_all", "tty", ttys=len(ttys)) as record:
+        problems, record["bytes"] = _write_all(ttys, data, timeout)
+    return problems
+
+
+def _write_all(
+    ttys: list[str], data: bytes, timeout: float
+) -> tuple[dict[str, str], int]:
+    problems: dict[str, str] = {}
+    written = 0
+    selector = selectors.DefaultSelector()
+    for tty in ttys:
         try:
-            with open(tty, "w") as handle:
-                handle.write(text)
-        except OSError:
-            pass  # a client that detached between listing it and writing to it
+            fd = os.open(tty, os.O_WRONLY | os.O_NONBLOCK | os.O_NOCTTY)
+        except OSError as ex:
+            # a client that detached between listing it and writing to it
+            problems[tty] = ex.strerror or str(ex)
+            continue
+        selector.register(fd, selectors.EVENT_WRITE, (tty, memoryview(data)))
+    deadline = time.monotonic() + timeout
+    try:
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _events in selector.select(remaining):
+                tty, view = key.data
+                try:
+                    count = os.write(key.fd, view)
+                except BlockingIOError:
+                    continue
+                except OSError as ex:
+                    problems[tty] = ex.strerror or str(ex)
+                    count = len(view)
+                else:
+                    written += count
+                view = view[count:]
+                if view:
+                    selector.modify(key.fd, selectors.EVENT_WRITE, (tty, view))
+                else:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+    finally:
+        for key in list(selector.get_map().values()):
+            tty, view = key.data
+            problems[tty] = (
+                f"took {len(data) - len(view)} of {len(data)} bytes"
+                f" in {timeout:g} s"
+            )
+            selector.unregister(key.fd)
+            os.close(key.fd)
+        selector.close()
+    return problems, written
+
+
+def repaint(
+    theme: str,
+    clients: list[str] | None = None,
+    target_dir: Path = THEME_DIR,
+) -> dict[str, str]:
+    """Push the palette at every terminal we can reach right now.
+
+    The bytes are generate()'s, if it left them, built only if it didn't.
+    What comes back is write_all()'s: the ttys that got dropped, and why.
+    """
+    try:
+        data = (target_dir / f"{theme}.palette.osc").read_bytes()
+    except OSError:
+        data = payload(theme, target_dir).encode()
+    return write_all(terminals(clients), data)
 
 
 def generate(target_dir: Path = THEME_DIR) -> None:
     """Both themes' palettes, as bytes a starting shell can print."""
     target_dir.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(target_dir)
+    inputs = input_hashes(Path(__file__))
     for theme in THEMES:
-        text = payload(theme)
-        (target_dir / f"{theme}.palette.osc").write_text(text)
-        (target_dir / f"{theme}.palette.tmux.osc").write_text(
-            through_tmux(text)
-        )
+        key = input_key(*inputs, theme)
+        plain = target_dir / f"{theme}.palette.osc"
+        wrapped = target_dir / f"{theme}.palette.tmux.osc"
+        if manifest.is_fresh(plain, key) and manifest.is_fresh(wrapped, key):
+            continue
+        text = payload(theme, target_dir)
+        manifest.write(plain, text, key)
+        manifest.write(wrapped, through_tmux(text), key)
+    manifest.save()
@@ -4,6 +4,10 @@ cfg/wezterm/colors says what a color is, roles.toml says what it is for, and
 each consumer's *.tmpl says how it wants them spelled: {{text.bright|zsh}}.
 """
 
+import hashlib
+import json
+import marshal
+import os
 import re
 import tomllib
 from dataclasses import dataclass, field
@@ -11,7 +15,7 @@ from functools import cache
 from pathlib import Path
 from typing import Any, Callable
 
-from libdotfiles.util import HOME_DIR
+from libdotfiles.util import CACHE_DIR, HOME_DIR
 
 THEMES = ("light", "dark")
 
@@ -142,31 +146,382 @@ FILTERS: dict[str, Callable[[Role, str], str]] = {
 }
 
 
-def render(template: str, roles: dict[str, Role], theme: str) -> str:
-    def substitute(match: re.Match[str]) -> str:
+# a literal, or a slot: role, filter, and the line it's on, for errors
+Segment = str | tuple[str, str, int]
+
+TEMPLATE_CACHE_DIR = CACHE_DIR / "theme" / "templates"
+
+
+def compile_template(text: str, where: str = "template") -> list[Segment]:
+    """Split a template once into literals and slots, good for any theme.
+
+    An unknown filter fails here and an unknown role in check_roles(), both
+    with the line they are on, and both before anything is written.
+    """
+    segments: list[Segment] = []
+    position = 0
+    line = 1
+    for match in PLACEHOLDER.finditer(text):
+        if match.start() > position:
+            segments.append(text[position : match.start()])
+        line += text.count("\n", position, match.start())
         name, filter_name = match[1], match[2] or "hex"
-        if name == "theme":  # the one thing that isn't a color
-            return theme
-        if name not in roles:
-            raise KeyError(f"template asks for unknown role {name!r}")
         if filter_name not in FILTERS:
-            raise KeyError(f"{name}: unknown filter {filter_name!r}")
-        return FILTERS[filter_name](roles[name], theme)
+            raise KeyError(f"{where}:{line}: unknown filter {filter_name!r}")
+        segments.append((name, filter_name, line))
+        line += text.count("\n", match.start(), match.end())
+        position = match.end()
+    if position < len(text):
+        segments.append(text[position:])
+    return segments
+
+
+def check_roles(
+    segments: list[Segment], roles: dict[str, Role], where: str
+) -> None:
+    unknown = [
+        f"{where}:{segment[2]}: unknown role {segment[0]!r}"
+        for segment in segments
+        if not isinstance(segment, str)
+        # the one thing that isn't a color
+        and segment[0] != "theme" and segment[0] not in roles
+    ]
+    if unknown:
+        raise KeyError("; ".join(unknown))
+
+
+def slots(*templates: list[Segment]) -> set[tuple[str, str]]:
+    """Every (role, filter) the compiled templates have a slot for."""
+    return {
+        (segment[0], segment[1])
+        for segments in templates
+        for segment in segments
+        if not isinstance(segment, str)
+    }
+
+
+def value_table(
+    roles: dict[str, Role], wanted: set[tuple[str, str]]
+) -> dict[tuple[str, str], list[str]]:
+    """Each wanted role through its filter, in every theme, worked out once.
+
+    Only what the templates at hand use: every role through every filter
+    took longer than rendering one template the slow way.
+    """
+    return {
+        (name, filter_name): (
+            list(THEMES)
+            if name == "theme"
+            else [FILTERS[filter_name](roles[name], theme) for theme in THEMES]
+        )
+        for name, filter_name in wanted
+    }
+
+
+def render_all(
+    segments: list[Segment], table: dict[tuple[str, str], list[str]]
+) -> list[str]:
+    """A compiled template in every theme at once, in THEMES' order."""
+    pieces: list[list[str]] = [[] for _theme in THEMES]
+    for segment in segments:
+        if isinstance(segment, str):
+            for piece in pieces:
+                piece.append(segment)
+        else:
+            for piece, value in zip(pieces, table[segment[0], segment[1]]):
+                piece.append(value)
+    return ["".join(piece) for piece in pieces]
 
-    return PLACEHOLDER.sub(substitute, template)
+
+def render(template: str, roles: dict[str, Role], theme: str) -> str:
+    """One template in one theme; generate() does them in bulk."""
+    segments = compile_template(template)
+    check_roles(segments, roles, "template")
+    table = value_table(roles, slots(segments))
+    return render_all(segments, table)[THEMES.index(theme)]
+
+
+def load_template(path: Path, data: bytes, key: str) -> list[Segment]:
+    """compile_template(), through a cache on disk under key.
+
+    marshal rather than json: loading the json back took longer than
+    compiling again.
+    """
+    cache_path = TEMPLATE_CACHE_DIR / f"{key}-{marshal.version}"
+    try:
+        segments: list[Segment] = marshal.loads(cache_path.read_bytes())
+        return segments
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    segments = compile_template(data.decode(), str(path))
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}")
+        temp_path.write_bytes(marshal.dumps(segments))
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass  # it only saves a compile
+    return segments
+
+
+@dataclass
+class Snapshot:
+    """One theme, resolved: what a consumer wants, without any TOML."""
+
+    theme: str
+    colors: dict[str, str] = field(default_factory=dict)
+    attrs: dict[str, list[str]] = field(default_factory=dict)
+    palette: dict[int | str, str] = field(default_factory=dict)
+
+
+SNAPSHOT_NAME = "snapshot.sh"
+
+
+def snapshot_mtimes() -> str:
+    """When everything a snapshot is made from last changed, as one word."""
+    return ":".join(
+        str(os.stat(path).st_mtime_ns)
+        for path in [Path(__file__), ROLES_PATH, *PALETTE_PATHS.values()]
+    )
+
+
+def build_snapshot(theme: str, roles: dict[str, Role]) -> Snapshot:
+    return Snapshot(
+        theme,
+        colors={name: role.color(theme) for name, role in roles.items()},
+        attrs={name: role.attrs for name, role in roles.items() if role.attrs},
+        palette=dict(load_palette(theme)),
+    )
+
+
+def format_snapshot(snapshot: Snapshot, mtimes: str) -> str:
+    """Plain sh assignments: role_surface__raised is surface.raised.
+
+    Dots can't be in a variable name and underscores already are, so a dot
+    is spelled `__`, which no role name has.
+    """
+    lines = [
+        "# Written by cfg/theme/render.py from roles.toml and the palette;"
+        " edit those.",
+        f"snapshot_theme='{snapshot.theme}'",
+        f"snapshot_mtimes='{mtimes}'",
+    ]
+    for name, color in sorted(snapshot.colors.items()):
+        lines.append(f"role_{name.replace('.', '__')}='{color}'")
+    for name, attrs in sorted(snapshot.attrs.items()):
+        lines.append(f"attrs_{name.replace('.', '__')}='{' '.join(attrs)}'")
+    for key, color in snapshot.palette.items():
+        lines.append(f"palette_{key}='{color}'")
+    return "\n".join(lines) + "\n"
+
+
+def load_snapshot(theme: str, target_dir: Path = THEME_DIR) -> Snapshot | None:
+    """The snapshot generate() wrote, or None if it's missing or stale."""
+    try:
+        text = (target_dir / f"{theme}.{SNAPSHOT_NAME}").read_text()
+        mtimes = snapshot_mtimes()
+    except OSError:
+        return None
+    values = {}
+    for line in text.splitlines():
+        key, equals, value = line.partition("=")
+        if equals and not key.startswith("#"):
+            values[key] = value.strip("'")
+    if values.get("snapshot_theme") != theme:
+        return None
+    if values.get("snapshot_mtimes") != mtimes:
+        return None
+    snapshot = Snapshot(theme)
+    for key, value in values.items():
+        kind, _, name = key.partition("_")
+        if kind == "role":
+            snapshot.colors[name.replace("__", ".")] = value
+        elif kind == "attrs":
+            snapshot.attrs[name.replace("__", ".")] = value.split()
+        elif kind == "palette":
+            snapshot.palette[int(name) if name.isdigit() else name] = value
+    return snapshot
+
+
+def load_theme(theme: str, target_dir: Path = THEME_DIR) -> Snapshot:
+    """One theme's colors: from its snapshot if that's fresh, else TOML."""
+    return load_snapshot(theme, target_dir) or build_snapshot(
+        theme, load_roles()
+    )
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def input_key(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def input_hashes(*code: Path) -> list[str]:
+    """What every rendered file depends on: the code, roles and palettes."""
+    return [
+        file_hash(path)
+        for path in [
+            Path(__file__),
+            *code,
+            ROLES_PATH,
+            *PALETTE_PATHS.values(),
+        ]
+    ]
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    """Write text to path unless it holds exactly that already."""
+    data = text.encode()
+    try:
+        if path.read_bytes() == data:
+            return False
+    except OSError:
+        pass
+    path.write_bytes(data)
+    return True
+
+
+class Manifest:
+    """What went into each rendered file, by hash, kept next to them.
+
+    An output whose inputs hash the same as when it was written, and that
+    nobody touched since, is still right, so a switch where nothing was
+    edited reads a few small files and renders nothing.
+    """
+
+    def __init__(self, target_dir: Path) -> None:
+        self.path = target_dir / "manifest.json"
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        self.outputs: dict[str, dict[str, Any]] = data.get("outputs", {})
+        self.templates: dict[str, Any] = data.get("templates", {})
+        self.dirty = False
+
+    def is_fresh(self, path: Path, key: str) -> bool:
+        entry = self.outputs.get(path.name)
+        if entry is None or entry.get("key") != key:
+            return False
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+        return (entry.get("mtime_ns"), entry.get("size")) == (
+            stat.st_mtime_ns,
+            stat.st_size,
+        )
+
+    def write(self, path: Path, text: str, key: str) -> None:
+        write_if_changed(path, text)
+        stat = path.stat()
+        self.outputs[path.name] = {
+            "key": key,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+        self.dirty = True
+
+    def find_templates(self) -> list[Path]:
+        """Every *.tmpl under cfg, without walking cfg if none came or went.
+
+        Adding or removing a template changes its directory's mtime, and a
+        new directory changes its parent's, so if every directory the last
+        walk saw is as it was, so is the list that walk found.
+        """
+        dirs: dict[str, int] = self.templates.get("dirs", {})
+        if dirs and all(
+            _mtime_ns(path) == mtime for path, mtime in dirs.items()
+        ):
+            return [Path(path) for path in self.templates.get("paths", [])]
+        dirs = {}
+        paths: list[str] = []
+        for directory, subdirs, files in os.walk(CFG_DIR):
+            subdirs[:] = [name for name in subdirs if name != "__pycache__"]
+            dirs[directory] = os.stat(directory).st_mtime_ns
+            paths.extend(
+                os.path.join(directory, name)
+                for name in files
+                if name.endswith(".tmpl")
+            )
+        self.templates = {"dirs": dirs, "paths": sorted(paths)}
+        self.dirty = True
+        return [Path(path) for path in sorted(paths)]
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        temp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        temp_path.write_text(
+            json.dumps(
+                {"outputs": self.outputs, "templates": self.templates},
+                indent=2,
+            )
+        )
+        os.replace(temp_path, self.path)
+
+
+def _mtime_ns(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
 
 def generate(target_dir: Path = THEME_DIR) -> None:
-    """Render every consumer's template, for both themes, into target_dir."""
+    """Render every consumer's template, for both themes, into target_dir.
+
+    Only what changed: roles.toml and the palettes are parsed only if some
+    output has to be rendered again, and an output that renders to what is
+    there already is left alone. Every template that has to be rendered is
+    compiled and checked before any output is written, so one bad template
+    leaves all of them as they were.
+    """
     target_dir.mkdir(parents=True, exist_ok=True)
-    roles = load_roles()
-    for template in sorted(CFG_DIR.glob("**/*.tmpl")):
-        text = template.read_text()
+    manifest = Manifest(target_dir)
+    inputs = input_hashes()
+    stale = []
+    for template in manifest.find_templates():
+        data = template.read_bytes()
+        template_hash = hashlib.sha256(data).hexdigest()
         name = template.name.removesuffix(".tmpl")
-        for theme in THEMES:
-            (target_dir / f"{theme}.{name}").write_text(
-                render(text, roles, theme)
+        outputs = [target_dir / f"{theme}.{name}" for theme in THEMES]
+        keys = [input_key(*inputs, template_hash, theme) for theme in THEMES]
+        if not all(map(manifest.is_fresh, outputs, keys)):
+            # inputs[0] is this file, which says how templates compile
+            segments = load_template(
+                template, data, input_key(inputs[0], template_hash)
             )
+            stale.append((template, segments, outputs, keys))
+    roles: dict[str, Role] | None = None
+    if stale:
+        roles = load_roles()
+        for template, segments, _outputs, _keys in stale:
+            check_roles(segments, roles, str(template))
+        table = value_table(
+            roles, slots(*(segments for _template, segments, *_ in stale))
+        )
+        for _template, segments, outputs, keys in stale:
+            texts = render_all(segments, table)
+            for output, key, text in zip(outputs, keys, texts):
+                manifest.write(output, text, key)
+    # for whatever wants colors without a template of its own: sh sources
+    # it, and load_theme() reads it back rather than parse any TOML
+    mtimes = snapshot_mtimes()
+    for theme in THEMES:
+        output = target_dir / f"{theme}.{SNAPSHOT_NAME}"
+        key = input_key(*inputs, mtimes, theme)
+        if manifest.is_fresh(output, key):
+            continue
+        if roles is None:
+            roles = load_roles()
+        snapshot = build_snapshot(theme, roles)
+        manifest.write(output, format_snapshot(snapshot, mtimes), key)
+    manifest.save()
 
 
 # rendered name -> the one path that consumer reads, for the consumers that
@@ -180,4 +535,6 @@ INSTALLED = {
 def install_theme(theme: str, target_dir: Path = THEME_DIR) -> None:
     for name, target in INSTALLED.items():
         if target.parent.is_dir():
-            target.write_text((target_dir / f"{theme}.{name}").read_text())
+            write_if_changed(
+                target, (target_dir / f"{theme}.{name}").read_text()
+            )
@@ -4,34 +4,106 @@ Installed onto PATH as `theme` by cfg/theme/__main__.py.
 """
 
 import argparse
+import asyncio
 import os
 import re
+import signal
+import sys
+import time
+from collections.abc import Collection, Coroutine, Sequence
+from dataclasses import dataclass
 from pathlib import Path
-from subprocess import DEVNULL, TimeoutExpired, run
+from typing import Any
 
-from cfg.theme import osc
+from cfg.theme import daemon, nvim, osc, timing, tmux
 from cfg.theme.render import (
     MARKER_PATH,
+    THEME_DIR,
     THEMES,
     current_theme,
     generate,
     install_theme,
 )
+from libdotfiles import aio, trace
 from libdotfiles.util import HOME_DIR
 
+# for every consumer together, not each: they are told side by side, and one
+# that hasn't answered by then is hung and not worth holding the switch for
+DEADLINE = 5.0
+# a consumer this slow gets named even though it made it
+SLOW = 1.0
 
-def quiet(*command: object) -> None:
-    """Nothing we poke at is worth failing the switch over."""
+
+@dataclass
+class Outcome:
+    name: str
+    seconds: float = 0.0
+    error: str | None = None
+    timed_out: bool = False
+
+
+async def poke(*command: object, check: bool = True) -> aio.Result | None:
+    """Run a command at a consumer; None if the program isn't installed."""
     try:
-        run(
-            [str(word) for word in command],
-            stdout=DEVNULL,
-            stderr=DEVNULL,
-            timeout=5,
-            check=False,
+        # a switch says nothing but what report() has to say
+        result = await aio.run_async(command, quiet=True)
+    except FileNotFoundError:
+        return None  # so there is nothing of it to update either
+    if check and result.returncode:
+        lines = result.stderr.strip().splitlines()
+        raise RuntimeError(
+            f"{command[0]} exited with {result.returncode}"
+            + (f": {lines[-1]}" if lines else "")
         )
-    except (OSError, TimeoutExpired):
-        pass
+    return result
+
+
+async def notify(
+    consumers: dict[str, Coroutine[Any, Any, None]],
+    deadline: float = DEADLINE,
+) -> list[Outcome]:
+    """Tell every consumer at once, and give up on the rest at deadline."""
+    outcomes = {name: Outcome(name) for name in consumers}
+
+    async def timed(name: str, coroutine: Coroutine[Any, Any, None]) -> None:
+        start = time.perf_counter()
+        try:
+            with trace.span(name, "notify"):
+                await coroutine
+        except Exception as ex:
+            outcomes[name].error = str(ex) or type(ex).__name__
+        finally:
+            outcomes[name].seconds = time.perf_counter() - start
+
+    tasks = {
+        asyncio.ensure_future(timed(name, coroutine)): name
+        for name, coroutine in consumers.items()
+    }
+    if not tasks:
+        return []
+    _done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        outcomes[tasks[task]].timed_out = True
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return list(outcomes.values())
+
+
+async def tell(theme: str) -> list[Outcome]:
+    return await notify(consumers(theme))
+
+
+def report(outcomes: list[Outcome], deadline: float = DEADLINE) -> list[str]:
+    """A line for every consumer that failed, hung or took its time."""
+    lines = []
+    for outcome in outcomes:
+        if outcome.timed_out:
+            lines.append(f"{outcome.name}: no answer within {deadline:g} s")
+        elif outcome.error is not None:
+            lines.append(f"{outcome.name}: failed: {outcome.error}")
+        elif outcome.seconds >= SLOW:
+            lines.append(f"{outcome.name}: slow, took {outcome.seconds:.1f} s")
+    return lines
 
 
 def update_wezterm_config(theme: str) -> None:
@@ -54,40 +126,91 @@ def update_theme_marker(theme: str) -> None:
     MARKER_PATH.write_text(theme + "\n")
 
 
-def update_running_nvim(theme: str) -> None:
-    # --headless, or the client spends a second waiting on the terminal
+def nvim_sockets() -> list[Path]:
     runtime_dir = Path(
         os.environ.get("XDG_RUNTIME_DIR", f"/run/user/{os.getuid()}")
     )
-    for socket in sorted(runtime_dir.glob("nvim.*")):
-        quiet(
-            "nvim",
-            "--headless",
-            "--server",
-            socket,
-            "--remote-expr",
-            f"execute('set background={theme}')",
-        )
+    return sorted(runtime_dir.glob("nvim.*"))
+
+
+async def update_running_nvim(socket: Path, theme: str) -> None:
+    await nvim.command(socket, f"set background={theme}")
 
 
-def update_running_tmux(theme: str) -> None:
+async def update_running_tmux(
+    theme: str, clients: "asyncio.Future[list[str]]"
+) -> None:
+    """Tell every tmux server, and pass on the ttys of their clients.
+
+    One tmux process per server for all of it; the repaint needs the
+    clients, so they are listed first, before anything that could fail.
+    """
     # setenv as well: a tmux server hands every pane it makes afterwards the
     # environment it was started with, so panes opened later announce the old
     # theme to everything in them that doesn't read the marker itself
-    quiet("tmux", "setenv", "-g", "THEME", theme)
-    quiet(
-        "tmux",
-        "source-file",
-        HOME_DIR / ".config" / "theme.d" / f"{theme}.colors.conf",
-    )
+    commands: list[Sequence[object]] = [
+        tmux.LIST_CLIENTS,
+        ["setenv", "-g", "THEME", theme],
+        ["source-file", THEME_DIR / f"{theme}.colors.conf"],
+    ]
+    ttys: list[str] = []
+    errors = []
+    try:
+        for batch in await tmux.batch_everywhere(commands):
+            ttys.extend(batch.replies[0].output)
+            if batch.error is not None:
+                errors.append(f"{batch.socket.name}: {batch.error}")
+    except FileNotFoundError:
+        pass  # no tmux on this machine
+    finally:
+        if not clients.done():
+            clients.set_result(ttys)
+    if errors:
+        raise RuntimeError("; ".join(errors))
+
+
+async def repaint_terminals(
+    theme: str, clients: "asyncio.Future[list[str]]"
+) -> None:
+    # a thread, but never for long: repaint() gives up on a tty on its own
+    problems = await asyncio.to_thread(osc.repaint, theme, await clients)
+    if problems:
+        raise RuntimeError(
+            "; ".join(f"{tty}: {why}" for tty, why in problems.items())
+        )
 
 
-def update_running_zsh() -> None:
-    # WINCH rather than USR1: shells that predate this redraw instead of dying
-    quiet("pkill", "-WINCH", "-x", "-u", os.getuid(), "zsh")
+def zsh_pids() -> list[int]:
+    """What `pgrep -x -u $UID zsh` would say, without a pgrep."""
+    pids = []
+    uid = os.getuid()
+    with os.scandir("/proc") as scan:
+        for entry in scan:
+            if not entry.name.isdigit():
+                continue
+            try:
+                if entry.stat().st_uid != uid:
+                    continue
+                with open(os.path.join(entry.path, "comm")) as handle:
+                    if handle.read().strip() == "zsh":
+                        pids.append(int(entry.name))
+            except OSError:
+                continue  # gone since the scandir
+    return pids
 
 
-def update_gtk_config(theme: str) -> None:
+async def update_running_zsh(subscribed: Collection[int] = ()) -> None:
+    # WINCH rather than USR1: shells that predate this redraw instead of
+    # dying. One subscribed to the daemon has been told already
+    for pid in zsh_pids():
+        if pid not in subscribed:
+            try:
+                os.kill(pid, signal.SIGWINCH)
+            except ProcessLookupError:
+                pass
+
+
+async def update_gtk_config(theme: str) -> None:
     gtk_theme = "Arc-Dark" if theme == "dark" else "Arc"
     for path, header in [
         (HOME_DIR / ".gtkrc-2.0", ""),
@@ -102,40 +225,118 @@ def update_gtk_config(theme: str) -> None:
         lines.append(f'gtk-theme-name="{gtk_theme}"')
         path.parent.mkdir(parents=True, exist_ok=True)
         path.write_text("\n".join(lines) + "\n")
-    run(
-        [
-            "gsettings",
-            "set",
-            "org.gnome.desktop.interface",
-            "gtk-key-theme",
-            gtk_theme,
-        ],
-        check=True,
+    await poke(
+        "gsettings",
+        "set",
+        "org.gnome.desktop.interface",
+        "gtk-key-theme",
+        gtk_theme,
     )
 
 
+def subscribed(subscribers: Collection[str], kind: str) -> set[str]:
+    """Who of a kind is subscribed to the daemon: `zsh 123` is 123."""
+    return {
+        who.partition(" ")[2]
+        for who in subscribers
+        if who.partition(" ")[0] == kind
+    }
+
+
+def consumers(
+    theme: str, subscribers: Collection[str] = ()
+) -> dict[str, Coroutine[Any, Any, None]]:
+    """Everything running that has to be told, by the name it's reported as.
+
+    Leaves out whoever is subscribed to the daemon, which told them already.
+    Call from inside the event loop that is going to tell them.
+    """
+    clients: asyncio.Future[list[str]]
+    clients = asyncio.get_running_loop().create_future()
+    listening_nvims = subscribed(subscribers, "nvim")
+    listening_shells = {
+        int(pid) for pid in subscribed(subscribers, "zsh") if pid.isdigit()
+    }
+    return {
+        "terminals": repaint_terminals(theme, clients),
+        **{
+            f"nvim {socket.name}": update_running_nvim(socket, theme)
+            for socket in nvim_sockets()
+            if str(socket) not in listening_nvims
+        },
+        "tmux": update_running_tmux(theme, clients),
+        "zsh": update_running_zsh(listening_shells),
+        "gtk": update_gtk_config(theme),
+    }
+
+
+def prepare(theme: str) -> None:
+    """Everything a switch writes, before anybody running is told."""
+    # rendering here rather than at install time means editing a role shows up
+    # on the next switch
+    with trace.span("generate", "switch"):
+        generate()
+    with trace.span("osc.generate", "switch"):
+        osc.generate()
+    with trace.span("install_theme", "switch"):
+        install_theme(theme)
+    with trace.span("wezterm", "switch"):
+        update_wezterm_config(theme)
+    # before anybody is told, since what they are told is to go and read it
+    with trace.span("marker", "switch"):
+        update_theme_marker(theme)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Switch this machine between the light and dark theme, "
         "or print the theme it is on."
     )
     parser.add_argument("theme", choices=THEMES, nargs="?")
-    theme = parser.parse_args().theme
-    if theme is None:
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="stay running, and switch and tell subscribers from here",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print what each step of the switch took",
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="print p50 and p95 of each step over past switches",
+    )
+    args = parser.parse_args()
+    if args.daemon:
+        daemon.run()
+        return
+    if args.summary:
+        print(timing.summarize(timing.load_history()))
+        return
+    if args.theme is None:
         print(current_theme("unknown"))
         return
-    # rendering here rather than at install time means editing a role shows up
-    # on the next switch
-    generate()
-    osc.generate()
-    install_theme(theme)
-    update_wezterm_config(theme)
-    osc.repaint(theme)
-    update_theme_marker(theme)
-    update_running_nvim(theme)
-    update_running_tmux(theme)
-    update_running_zsh()
-    update_gtk_config(theme)
+    reply = daemon.request(f"switch {args.theme}")
+    if reply is not None:
+        *lines, status = reply or ["error no reply"]
+        for line in lines:
+            print(f"theme: {line}", file=sys.stderr)
+        if status != "done":
+            sys.exit(f"theme: {status.removeprefix('error ')}")
+        if args.profile:
+            # the daemon recorded it just before it said done
+            for entry in timing.load_history()[-1:]:
+                print(timing.format_profile(entry))
+        return
+    with timing.timed(args.theme, "local") as entry:
+        prepare(args.theme)
+        lines = report(asyncio.run(tell(args.theme)))
+    for line in lines:
+        print(f"theme: {line}", file=sys.stderr)
+    if args.profile:
+        print(timing.format_profile(entry))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+"""What every switch cost, step by step, kept across switches.
+
+A slow `theme dark` could be the rendering, gtk, an nvim or tmux, and the
+next one is rarely slow the same way. So every switch, wherever it runs,
+appends a line to HISTORY_PATH: how long each step and each consumer took,
+how many processes it started and how many bytes it wrote to ttys. The steps
+are libdotfiles.trace spans, collected whether DOTFILES_TRACE is set or not:
+the switch opens a span per step, and util and aio already open one per
+process. `theme --profile` prints the line for the switch it just did, and
+`theme --summary` the p50 and p95 of each step over every switch so far.
+"""
+
+import json
+import math
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from libdotfiles import trace
+from libdotfiles.util import STATE_DIR
+
+HISTORY_PATH = STATE_DIR / "theme" / "switches.jsonl"
+
+# the span categories that are steps of a switch, rather than what they did
+STEP_CATEGORIES = {"switch", "notify"}
+
+
+def tally(spans: list[dict[str, Any]]) -> dict[str, Any]:
+    """A switch's spans, as the fields of its line of history."""
+    steps: dict[str, float] = {}
+    subprocesses = 0
+    tty_bytes = 0
+    for span in spans:
+        if span["cat"] in STEP_CATEGORIES:
+            steps[span["name"]] = round(
+                steps.get(span["name"], 0) + span["dur"] / 1000, 3
+            )
+        elif span["cat"] == "run":
+            subprocesses += 1
+        elif span["cat"] == "tty":
+            tty_bytes += int(span["args"].get("bytes", 0))
+    return {
+        "steps": steps,
+        "subprocesses": subprocesses,
+        "tty_bytes": tty_bytes,
+    }
+
+
+@contextmanager
+def timed(
+    theme: str, via: str, history_path: Path = HISTORY_PATH
+) -> Iterator[dict[str, Any]]:
+    """Time the switch in the block, and add it to the history.
+
+    The dict yielded is that line of history, filled in once the block is
+    done: a switch that failed goes in too, with the error.
+    """
+    entry: dict[str, Any] = {"time": time.time(), "theme": theme, "via": via}
+    start = time.perf_counter()
+    try:
+        with trace.collect() as spans:
+            yield entry
+    except Exception as ex:
+        entry["error"] = str(ex) or type(ex).__name__
+        raise
+    finally:
+        entry["total_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        entry.update(tally(spans))
+        try:
+            history_path.parent.mkdir(parents=True, exist_ok=True)
+            with history_path.open("a", encoding="utf-8") as handle:
+                handle.write(json.dumps(entry) + "\n")
+        except OSError:
+            pass  # the switch itself went fine
+
+
+def load_history(history_path: Path = HISTORY_PATH) -> list[dict[str, Any]]:
+    entries = []
+    try:
+        lines = history_path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue  # cut short by a switch that died mid-write
+    return entries
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest rank: a value that was actually seen, never an average."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def step_kind(name: str) -> str:
+    """nvim consumers are named per socket; across switches they are one."""
+    if name.startswith("nvim "):
+        return "nvim (each socket)"
+    return name
+
+
+def format_profile(entry: dict[str, Any]) -> str:
+    steps = sorted(entry.get("steps", {}).items(), key=lambda item: -item[1])
+    width = max((len(name) for name, _ms in steps), default=4)
+    lines = [f"{name:<{width}}  {ms:>9.1f} ms" for name, ms in steps]
+    lines.append(
+        f"{entry.get('total_ms', 0):.1f} ms in all,"
+        f" {entry.get('subprocesses', 0)} processes started,"
+        f" {entry.get('tty_bytes', 0)} bytes written to ttys"
+    )
+    return "\n".join(lines)
+
+
+def summarize(entries: list[dict[str, Any]]) -> str:
+    """p50 and p95 of every step, the total and the counts, over entries."""
+    if not entries:
+        return "no switches recorded yet"
+    rows: dict[str, list[float]] = {"total": []}
+    for entry in entries:
+        rows["total"].append(entry.get("total_ms", 0))
+        for name, ms in entry.get("steps", {}).items():
+            rows.setdefault(step_kind(name), []).append(ms)
+    order = [
+        "total",
+        *sorted(
+            set(rows) - {"total"}, key=lambda name: -percentile(rows[name], 95)
+        ),
+    ]
+    width = max(len(name) for name in rows)
+    lines = [f"{'step':<{width}}  {'count':>5}  {'p50 ms':>9}  {'p95 ms':>9}"]
+    for name in order:
+        values = rows[name]
+        lines.append(
+            f"{name:<{width}}  {len(values):>5}"
+            f"  {percentile(values, 50):>9.1f}  {percentile(values, 95):>9.1f}"
+        )
+    for key, label in [
+        ("subprocesses", "processes started"),
+        ("tty_bytes", "bytes written to ttys"),
+    ]:
+        counts = [float(entry.get(key, 0)) for entry in entries]
+        lines.append(
+            f"{label}: p50 {percentile(counts, 50):g},"
+            f" p95 {percentile(counts, 95):g}"
+        )
+    return "\n".join(lines)
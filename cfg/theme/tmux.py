@@ -0,0 +1,125 @@
+"""Ask every running tmux server for several things in one go.
+
+Each `tmux` process pays for its own connection to the server, and a switch
+used to start three: setenv, source-file and list-clients. batch() chains
+the commands with `;` so that one process runs them all, with a
+`display-message -p` between every two, so what each printed and how far
+tmux got can be told apart afterwards.
+
+A `tmux` run from outside a pane only ever reaches the default server, and
+from inside one only the server of that pane, so which servers a switch
+told depended on where it was run from. servers() finds the socket of every
+server of ours, and each gets a batch of its own.
+"""
+
+import asyncio
+import itertools
+import os
+import stat
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from libdotfiles import aio
+
+LIST_CLIENTS = ["list-clients", "-F", "#{client_tty}"]
+
+# what tmux says when a socket has no server behind it any more
+NO_SERVER = ("no server running", "error connecting")
+
+_markers = itertools.count()
+
+
+@dataclass
+class Reply:
+    command: list[str]
+    output: list[str] = field(default_factory=list)
+    # tmux stops a batch at the first command that fails, so a command that
+    # isn't done either failed itself or never ran
+    done: bool = False
+
+
+@dataclass
+class Batch:
+    socket: Path
+    replies: list[Reply]
+    error: str | None = None
+    running: bool = True
+
+    def check(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(f"tmux at {self.socket}: {self.error}")
+
+
+def socket_dir() -> Path:
+    tmp_dir = os.environ.get("TMUX_TMPDIR") or "/tmp"
+    return Path(tmp_dir) / f"tmux-{os.getuid()}"
+
+
+def servers() -> list[Path]:
+    """The socket of every tmux server this user may be running."""
+    try:
+        with os.scandir(socket_dir()) as scan:
+            return sorted(
+                Path(entry.path)
+                for entry in scan
+                if stat.S_ISSOCK(entry.stat(follow_symlinks=False).st_mode)
+            )
+    except OSError:
+        return []
+
+
+async def batch(
+    socket: Path,
+    commands: Sequence[Sequence[object]],
+    timeout: float | None = None,
+) -> Batch:
+    """Run commands on the server at socket, with one tmux process."""
+    # no # or %: display-message expands formats, then strftime escapes
+    marker = f"theme-batch-{os.getpid()}-{next(_markers)}"
+    args: list[object] = ["tmux", "-S", socket]
+    for command in commands:
+        args += [*command, ";", "display-message", "-p", marker, ";"]
+    result = await aio.run_async(args[:-1], timeout=timeout, quiet=True)
+
+    replies = [Reply([str(word) for word in command]) for command in commands]
+    index = 0
+    for line in result.stdout.splitlines():
+        if index >= len(replies):
+            break
+        if line == marker:
+            replies[index].done = True
+            index += 1
+        else:
+            replies[index].output.append(line)
+
+    outcome = Batch(socket, replies)
+    if result.timed_out:
+        outcome.error = f"no answer within {timeout:g} s"
+    elif result.returncode:
+        outcome.error = (
+            result.stderr.strip() or f"tmux exited with {result.returncode}"
+        )
+        outcome.running = index > 0 or not any(
+            text in result.stderr for text in NO_SERVER
+        )
+    return outcome
+
+
+async def batch_everywhere(
+    commands: Sequence[Sequence[object]], timeout: float | None = None
+) -> list[Batch]:
+    """batch() on every server running, side by side."""
+    batches = await asyncio.gather(
+        *(batch(socket, commands, timeout) for socket in servers())
+    )
+    return [outcome for outcome in batches if outcome.running]
+
+
+def client_ttys(timeout: float = 5) -> list[str]:
+    """Every tmux client's tty, for code that isn't a coroutine itself."""
+    try:
+        batches = asyncio.run(batch_everywhere([LIST_CLIENTS], timeout))
+    except OSError:
+        return []  # no tmux on this machine
+    return [tty for outcome in batches for tty in outcome.replies[0].output]
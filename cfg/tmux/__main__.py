@@ -8,4 +8,6 @@ create_symlink(PKG_DIR / "config", HOME_DIR / ".config" / "tmux")
 git_clone(
     "https://github.com/tmux-plugins/tpm",
     HOME_DIR / ".config" / "tmux" / "plugins" / "tpm",
+    depth=1,
+    update=True,
 )
@@ -0,0 +1,2 @@
+# the colors it sources are rendered by theme(1)
+DEPENDS = ["theme"]
@@ -1,4 +1,4 @@
-from libdotfiles.packages import try_install
+from libdotfiles.packages import batched, try_install
 from libdotfiles.util import (
     HOME_DIR,
     PKG_DIR,
@@ -8,10 +8,11 @@ from libdotfiles.util import (
     run,
 )
 
-if get_distro_name() == "arch":
-    try_install("inetutils")  # hostname in PS1
-try_install("zsh")
-try_install("less")  # for lesskey
+with batched():
+    if get_distro_name() == "arch":
+        try_install("inetutils")  # hostname in PS1
+    try_install("zsh")
+    try_install("less")  # for lesskey
 
 create_symlinks(
     [
@@ -0,0 +1,161 @@
+"""run() for many commands at once.
+
+util.run() waits for each command before it starts the next, which is right
+for commands that change something and slow for ones that only ask. A
+`dpkg -l` or `pip show` per package spends most of its time starting up, and
+none of them needs the others done first. run_many() starts them side by
+side, at most limit at a time. Each command gets its own timeout, and the
+results come back in the order the commands went in.
+
+The commands take util.run()'s lock like they would there, so a package
+manager call that changes something still never runs beside another one.
+Pass exclusive=False for commands that only ask, which need no turn.
+"""
+
+import asyncio
+import logging
+import shlex
+import subprocess
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from libdotfiles import trace
+from libdotfiles.util import FACTS, exclusive_lock, is_exclusive
+
+logger = logging.getLogger(__name__)
+
+# the commands this is for wait on disk and network, not on the CPU
+DEFAULT_LIMIT = 8
+
+
+@dataclass
+class Result:
+    """One command's outcome; returncode is negative if it got killed."""
+
+    args: list[str]
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+
+    def check_returncode(self) -> None:
+        if self.timed_out:
+            raise subprocess.TimeoutExpired(self.args, 0, self.stdout)
+        if self.returncode:
+            raise subprocess.CalledProcessError(
+                self.returncode, self.args, self.stdout, self.stderr
+            )
+
+
+async def run_async(
+    command: Sequence[Any],
+    timeout: float | None = None,
+    cwd: Path | None = None,
+    quiet: bool = False,
+    exclusive: bool | None = None,
+) -> Result:
+    """util.run() with capture_output and text, as a coroutine.
+
+    quiet logs the command at DEBUG rather than INFO, for callers whose
+    commands are their own business rather than a step worth announcing.
+    """
+    args = [str(word) for word in command]
+    command_line = shlex.join(args)
+    logger.log(
+        logging.DEBUG if quiet else logging.INFO, "Running %r...", command_line
+    )
+    exclusive = is_exclusive(args, exclusive)
+    with trace.span(Path(args[0]).name, "run", command=command_line) as record:
+        async with _exclusive_lock(args, exclusive):
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=cwd,
+            )
+            timed_out = False
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(), timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "%r took longer than %s s, killing it",
+                    command_line,
+                    timeout,
+                )
+                process.kill()
+                stdout, stderr = await process.communicate()
+                timed_out = True
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+        if exclusive:
+            # it may well have installed a program
+            FACTS.forget_executables()
+        assert process.returncode is not None
+        record["returncode"] = process.returncode
+        record["bytes"] = len(stdout)
+        return Result(
+            args,
+            process.returncode,
+            stdout.decode(errors="replace"),
+            stderr.decode(errors="replace"),
+            timed_out,
+        )
+
+
+async def gather(
+    commands: Sequence[Sequence[Any]],
+    limit: int = DEFAULT_LIMIT,
+    timeout: float | None = None,
+    exclusive: bool | None = None,
+) -> list[Result]:
+    """run_async() each command, at most limit at a time, in order."""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run_one(command: Sequence[Any]) -> Result:
+        async with semaphore:
+            return await run_async(
+                command, timeout=timeout, exclusive=exclusive
+            )
+
+    tasks = [asyncio.ensure_future(run_one(command)) for command in commands]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        # one command that couldn't even start takes the rest down with it
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def run_many(
+    commands: Sequence[Sequence[Any]],
+    limit: int = DEFAULT_LIMIT,
+    timeout: float | None = None,
+    exclusive: bool | None = None,
+) -> list[Result]:
+    """gather(), for code that isn't a coroutine itself."""
+    if not commands:
+        return []
+    return asyncio.run(gather(commands, limit, timeout, exclusive))
+
+
+@asynccontextmanager
+async def _exclusive_lock(
+    command: list[str], exclusive: bool | None
+) -> AsyncIterator[None]:
+    # flock blocks, so wait for it off the event loop
+    lock = exclusive_lock(command, exclusive)
+    await asyncio.to_thread(lock.__enter__)
+    try:
+        yield
+    finally:
+        lock.__exit__(None, None, None)
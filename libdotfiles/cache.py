@@ -0,0 +1,77 @@
+"""Answers worth keeping between runs, each for as long as it stays true.
+
+Whether PyPI or the AUR has a package changes on the order of days, and a
+bootstrap asks about the same few dozen names every time it runs. Keep the
+answers on disk with an expiry, the negative ones included, so a repeat run
+never goes to the network for them.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from libdotfiles.util import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """A JSON file of key -> (value, expiry). None is never a value."""
+
+    def __init__(self, name: str, cache_dir: Path = CACHE_DIR) -> None:
+        self.path = cache_dir / f"{name}.json"
+        self._entries: dict[str, tuple[Any, float]] | None = None
+        self._dirty: dict[str, tuple[Any, float]] = {}
+
+    def get(self, key: str) -> Any:
+        entry = self._load().get(key)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        entry = (value, time.time() + ttl)
+        self._load()[key] = entry
+        self._dirty[key] = entry
+
+    def save(self) -> None:
+        """Write our changes over whatever is on disk now.
+
+        Modules install side by side, so re-read first: another process may
+        have cached something since we loaded.
+        """
+        if not self._dirty:
+            return
+        entries = {**self._read(), **self._dirty}
+        now = time.time()
+        entries = {
+            key: entry for key, entry in entries.items() if entry[1] >= now
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.path.parent, delete=False, encoding="utf-8"
+        ) as handle:
+            json.dump(entries, handle)
+        os.replace(handle.name, self.path)
+        self._entries = entries
+        self._dirty.clear()
+
+    def _load(self) -> dict[str, tuple[Any, float]]:
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    def _read(self) -> dict[str, tuple[Any, float]]:
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+            return {
+                key: (value, expiry) for key, (value, expiry) in raw.items()
+            }
+        except (OSError, ValueError, TypeError) as ex:
+            if self.path.exists():
+                logger.warning("Ignoring unreadable %s: %s", self.path, ex)
+            return {}
@@ -0,0 +1,172 @@
+"""What the modules keep asking about the machine, worked out once.
+
+Every module asks which distro this is, usually more than once, and
+has_executable() is the most common call in cfg/. Each answer used to cost a
+parse of /etc/os-release, a walk over PATH or a `whoami` fork. None of them
+change while a bootstrap runs, save for new programs, so remember them.
+
+Programs are looked up in a listing of every PATH directory, taken once. A
+directory is listed again only when its mtime says something came or went,
+and only once something may have changed it: libdotfiles.util marks the
+listing stale after every command that changes the system and every file it
+creates, but not after the queries and builds in between. With a cache path,
+the listings and the distro survive between runs, keyed by the mtimes they
+were read at.
+"""
+
+import json
+import logging
+import os
+import pwd
+import shutil
+from functools import cached_property
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+OS_RELEASE_PATH = Path("/etc/os-release")
+
+
+class HostFacts:
+    def __init__(
+        self,
+        cache_path: Path | None = None,
+        os_release_path: Path = OS_RELEASE_PATH,
+    ) -> None:
+        self.cache_path = cache_path
+        self.os_release_path = os_release_path
+        # directory -> (mtime_ns, names in it)
+        self._listings: dict[str, tuple[int, set[str]]] = {}
+        self._path_dirs: list[str] = []
+        self._path = ""
+        self._found: dict[str, bool] = {}
+        self._stale = True
+        self._dirty = False
+
+    @cached_property
+    def distro(self) -> str:
+        try:
+            mtime = self.os_release_path.stat().st_mtime_ns
+        except OSError:
+            return "unknown"
+        cached = self._cached.get("distro")
+        if cached and cached[0] == mtime:
+            return str(cached[1])
+        distro = "unknown"
+        for line in self.os_release_path.read_text().splitlines():
+            key, _, value = line.partition("=")
+            if key.lower() == "id":
+                distro = value.strip('"')
+                break
+        self._cached["distro"] = (mtime, distro)
+        self._dirty = True
+        return distro
+
+    @cached_property
+    def hostname(self) -> str:
+        return os.uname().nodename
+
+    @cached_property
+    def username(self) -> str:
+        """Who whoami would say we are, without forking it."""
+        try:
+            return pwd.getpwuid(os.geteuid()).pw_name
+        except KeyError:
+            # no passwd entry, as in some containers
+            return os.environ.get("USER") or str(os.geteuid())
+
+    def has_executable(self, program: str) -> bool:
+        if os.sep in program:
+            return shutil.which(program) is not None
+        if os.environ.get("PATH", os.defpath) != self._path:
+            self._stale = True
+        if self._stale:
+            self._refresh_listings()
+        if program in self._found:
+            return self._found[program]
+        found = any(
+            program in self._listings[directory][1]
+            and shutil.which(program, path=directory) is not None
+            for directory in self._path_dirs
+        )
+        self._found[program] = found
+        return found
+
+    def forget_executables(self) -> None:
+        """Something may have installed or removed a program."""
+        self._stale = True
+
+    def save(self) -> None:
+        if self.cache_path is None or not self._dirty:
+            return
+        self._cached["path"] = {
+            directory: (mtime, sorted(names))
+            for directory, (mtime, names) in self._listings.items()
+        }
+        import tempfile
+
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self.cache_path.parent, delete=False, encoding="utf-8"
+            ) as handle:
+                json.dump(self._cached, handle)
+            os.replace(handle.name, self.cache_path)
+        except OSError as ex:
+            logger.warning("Can't save %s: %s", self.cache_path, ex)
+            return
+        self._dirty = False
+
+    def _refresh_listings(self) -> None:
+        path = os.environ.get("PATH", os.defpath)
+        changed = path != self._path
+        self._path = path
+        self._path_dirs = list(
+            dict.fromkeys(
+                os.path.abspath(directory) if directory else os.curdir
+                for directory in self._path.split(os.pathsep)
+            )
+        )
+        cached = self._cached.get("path", {})
+        for directory in self._path_dirs:
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                if self._listings.get(directory, (0, set()))[1]:
+                    changed = True
+                self._listings[directory] = (0, set())
+                continue
+            known = self._listings.get(directory)
+            if known is None and directory in cached:
+                known = (cached[directory][0], set(cached[directory][1]))
+            if known is None or known[0] != mtime:
+                known = (mtime, self._list(directory))
+                self._dirty = changed = True
+            self._listings[directory] = known
+        if changed:
+            self._found.clear()
+        self._stale = False
+
+    @staticmethod
+    def _list(directory: str) -> set[str]:
+        try:
+            with os.scandir(directory) as entries:
+                return {entry.name for entry in entries}
+        except OSError:
+            return set()
+
+    @cached_property
+    def _cached(self) -> dict[str, Any]:
+        """What the last run saved; read on first use, not on import."""
+        if self.cache_path is None:
+            return {}
+        try:
+            cached = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as ex:
+            if self.cache_path.exists():
+                logger.warning(
+                    "Ignoring unreadable %s: %s", self.cache_path, ex
+                )
+            return {}
+        return cached if isinstance(cached, dict) else {}
@@ -0,0 +1,334 @@
+"""The programs create_script() puts on PATH, and what keeps them quick.
+
+A `#!/bin/sh` wrapper around `python3 -m <module>` paid for a shell, then an
+interpreter, then every import, on every call. A launcher is now a Python
+script that puts the repo on sys.path itself, and the modules it runs are
+compiled when it is installed, so no call ever compiles them.
+
+A resident launcher goes further: it only passes its arguments, environment,
+working directory and stdin/stdout/stderr over a Unix socket to a server
+that has the module's imports loaded already and forks a child per call. The
+launcher starts the server when there is none and runs the module itself
+meanwhile; the server exits when idle for a while, or when a source file it
+loaded changed, and the next call starts a fresh one.
+"""
+
+import compileall
+import importlib
+import os
+import runpy
+import signal
+import socket
+import stat
+import struct
+import sys
+import threading
+import traceback
+from pathlib import Path
+from typing import Any
+
+# every launcher says so on its second line; tools/bench_launchers looks
+MARKER = "# launcher written by libdotfiles.launcher"
+# how long a resident server waits for a call before it exits
+IDLE_TIMEOUT = 15 * 60
+MAX_REQUEST = 1024 * 1024
+
+DIRECT_TEMPLATE = """\
+#!{python}
+{marker}
+import os
+import sys
+
+os.environ["PYTHONPATH"] = {repo!r}
+sys.path.insert(0, {repo!r})
+import runpy
+
+runpy.run_module({module!r}, run_name="__main__", alter_sys=True)
+"""
+
+# -S: the client needs nothing from site-packages, and site is a third of a
+# bare interpreter's start. _socket rather than socket, whose enums alone
+# cost more than the rest of the client
+RESIDENT_TEMPLATE = """\
+#!{python} -S
+{marker} (resident)
+import _socket
+import os
+import struct
+import sys
+
+PYTHON = {python!r}
+REPO = {repo!r}
+MODULE = {module!r}
+RUNTIME_DIR = (
+    os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/dotfiles-{{os.getuid()}}"
+)
+SOCKET_DIR = os.path.join(RUNTIME_DIR, "dotfiles")
+SOCKET_PATH = os.path.join(SOCKET_DIR, MODULE + ".sock")
+
+
+def private(directory):
+    # is_private(), without importing stat
+    try:
+        info = os.lstat(directory)
+    except OSError:
+        return False
+    return info.st_mode & 0o170077 == 0o040000 and info.st_uid == os.getuid()
+
+
+def run_here():
+    import subprocess
+
+    env = {{**os.environ, "PYTHONPATH": REPO}}
+    subprocess.Popen(
+        [PYTHON, "-m", "libdotfiles.launcher", MODULE, SOCKET_PATH],
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    os.execve(PYTHON, [PYTHON, "-m", MODULE, *sys.argv[1:]], env)
+
+
+request = b"\\0".join(
+    [
+        os.fsencode(os.getcwd()),
+        str(len(sys.argv)).encode(),
+        *map(os.fsencode, sys.argv),
+        *(key + b"=" + value for key, value in os.environb.items()),
+    ]
+)
+request = struct.pack("!I", len(request)) + request
+# whoever made the directory could be listening, and is about to get our
+# environment and our tty
+if not (private(RUNTIME_DIR) and private(SOCKET_DIR)):
+    run_here()
+client = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+try:
+    client.connect(SOCKET_PATH)
+    ttys = struct.pack("3i", 0, 1, 2)
+    fds = [(_socket.SOL_SOCKET, _socket.SCM_RIGHTS, ttys)]
+    sent = client.sendmsg([request], fds)
+    client.sendall(request[sent:])
+except OSError:
+    # no server, or a stale one that hung up on us
+    run_here()
+reply = b""
+while True:
+    try:
+        chunk = client.recv(16)
+    except KeyboardInterrupt:
+        client.sendall(b"I")
+        continue
+    except OSError:
+        break
+    if not chunk:
+        break
+    reply += chunk
+    if reply[:1] == b"S" or len(reply) >= 6:
+        break
+if reply[:1] != b"R":
+    # a stale server, or one that quit before taking the call
+    run_here()
+if len(reply) < 6:
+    sys.exit(1)
+sys.exit(struct.unpack("!i", reply[2:6])[0])
+"""
+
+
+def source(module: str, repo_dir: Path, python: str, resident: bool) -> str:
+    template = RESIDENT_TEMPLATE if resident else DIRECT_TEMPLATE
+    return template.format(
+        python=python, marker=MARKER, repo=str(repo_dir), module=module
+    )
+
+
+def precompile(module: str, repo_dir: Path) -> None:
+    """Byte-compile module's package and libdotfiles ahead of the first call.
+
+    Python would do it on the first import, but only where it may write, and
+    a checkout edited since shouldn't cost the next `theme` the compile.
+    """
+    path = repo_dir.joinpath(*module.split("."))
+    package = path if path.is_dir() else path.parent
+    for directory in {package, Path(__file__).parent}:
+        compileall.compile_dir(directory, quiet=1)
+
+
+def runtime_dir() -> Path:
+    """Where our sockets go: $XDG_RUNTIME_DIR, or one of our own in /tmp."""
+    return Path(
+        os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/dotfiles-{os.getuid()}"
+    )
+
+
+def is_private(*directories: Path) -> bool:
+    """Whether each is a directory of ours that nobody else may get into.
+
+    Anybody can make /tmp/dotfiles-<uid> before we do, and then the socket
+    in it is theirs to plant: a client checks this before it connects to
+    one, not only the server before it binds.
+    """
+    for directory in directories:
+        try:
+            info = os.lstat(directory)
+        except OSError:
+            return False
+        if (
+            not stat.S_ISDIR(info.st_mode)
+            or info.st_uid != os.getuid()
+            or stat.S_IMODE(info.st_mode) & 0o077
+        ):
+            return False
+    return True
+
+
+def make_socket_dir(socket_path: Path) -> None:
+    """Make the directories socket_path goes in; fail if they aren't ours."""
+    socket_path.parent.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    socket_path.parent.mkdir(mode=0o700, exist_ok=True)
+    if not is_private(socket_path.parent.parent, socket_path.parent):
+        raise RuntimeError(f"{socket_path.parent} isn't ours alone")
+
+
+def serve(module: str, socket_path: Path) -> None:
+    """Fork a child per call that runs module as __main__ from here."""
+    importlib.import_module(module)  # what the children are spared
+    # but run as __main__, from scratch, like `python3 -m` would
+    del sys.modules[module]
+    sources = _source_mtimes()
+    make_socket_dir(socket_path)
+    socket_path.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    server.listen()
+    server.settimeout(IDLE_TIMEOUT)
+    inode = socket_path.stat().st_ino
+    # nobody waits for the children; their clients learn how they exited
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        while True:
+            try:
+                connection, _address = server.accept()
+            except TimeoutError:
+                break
+            if _source_mtimes() != sources:
+                connection.sendall(b"S")
+                connection.close()
+                break
+            if os.fork() == 0:
+                server.close()
+                _serve_call(connection, module)
+            connection.close()
+    finally:
+        # another server may have taken the path over since we bound it
+        try:
+            if socket_path.stat().st_ino == inode:
+                socket_path.unlink()
+        except OSError:
+            pass
+
+
+def _serve_call(connection: socket.socket, module: str) -> None:
+    """Become the client's process, as far as one can, and run module."""
+    code = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        request = _read_request(connection)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.argv = request["argv"]
+        sys.stdout.reconfigure(line_buffering=os.isatty(1))  # type: ignore
+        connection.sendall(b"R")
+        threading.Thread(
+            target=_watch_client, args=(connection,), daemon=True
+        ).start()
+        code = _run_main(module)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            connection.sendall(b"X" + struct.pack("!i", code))
+        except OSError:
+            pass
+        os._exit(0)
+
+
+def _read_request(connection: socket.socket) -> dict[str, Any]:
+    data, fds, _flags, _address = socket.recv_fds(connection, 65536, 3)
+    if len(fds) != 3 or len(data) < 4:
+        raise RuntimeError("malformed call")
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    (size,) = struct.unpack("!I", data[:4])
+    if size > MAX_REQUEST:
+        raise RuntimeError("call too large")
+    data = data[4:]
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise RuntimeError("call cut short")
+        data += chunk
+    # cwd, argc, argv..., KEY=VALUE...: no json, which the client would
+    # have to import
+    cwd, argc, *rest = map(os.fsdecode, data.split(b"\0"))
+    argv, env = rest[: int(argc)], rest[int(argc) :]
+    return {
+        "cwd": cwd,
+        "argv": argv,
+        "env": dict(item.split("=", 1) for item in env),
+    }
+
+
+def _watch_client(connection: socket.socket) -> None:
+    """Pass the client's ^C on, and stop when the client is gone."""
+    while True:
+        try:
+            data = connection.recv(1)
+        except OSError:
+            data = b""
+        if data == b"I":
+            os.kill(os.getpid(), signal.SIGINT)
+        elif not data:
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+
+def _run_main(module: str) -> int:
+    try:
+        runpy.run_module(module, run_name="__main__", alter_sys=True)
+    except SystemExit as ex:
+        if ex.code is None or isinstance(ex.code, int):
+            return ex.code or 0
+        print(ex.code, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+
+def _source_mtimes() -> dict[str, int]:
+    repo_dir = str(Path(__file__).parent.parent)
+    mtimes = {}
+    for loaded in list(sys.modules.values()):
+        path = getattr(loaded, "__file__", None)
+        if path and path.startswith(repo_dir):
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = 0
+    return mtimes
+
+
+def main() -> None:
+    module, socket_path = sys.argv[1:]
+    serve(module, Path(socket_path))
+
+
+if __name__ == "__main__":
+    main()
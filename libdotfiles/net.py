@@ -0,0 +1,113 @@
+"""Keep-alive HTTP connections, shared by everything that asks the network.
+
+urllib opens a connection, and for https a TLS session, per request. Asking
+PyPI about thirty packages that way spends more on handshakes than answers,
+so hold on to finished connections and hand them to the next request for the
+same host.
+"""
+
+import http.client
+import logging
+import threading
+import urllib.parse
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 10
+USER_AGENT = "mozilla"
+
+# what a server does to a keep-alive connection it got bored of
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class ConnectionPool:
+    def __init__(self, timeout: float = TIMEOUT) -> None:
+        self.timeout = timeout
+        self._idle: dict[tuple[str, str], list[http.client.HTTPConnection]] = (
+            {}
+        )
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def fetch(
+        self,
+        url: str,
+        method: str = "GET",
+        headers: dict[str, str] | None = None,
+    ) -> Iterator[http.client.HTTPResponse]:
+        """Send one request and hand back the response, unread.
+
+        The connection goes back to the pool if the caller read the body to
+        the end, and is closed otherwise.
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"can't fetch {url!r} over a connection pool")
+        key = (parts.scheme, parts.netloc)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        all_headers = {"User-Agent": USER_AGENT, **(headers or {})}
+
+        connection, reused = self._acquire(key)
+        try:
+            try:
+                connection.request(method, target, headers=all_headers)
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                connection.close()
+                connection = self._connect(key)
+                connection.request(method, target, headers=all_headers)
+                response = connection.getresponse()
+            yield response
+        except BaseException:
+            connection.close()
+            raise
+        if response.isclosed() and not response.will_close:
+            self._release(key, connection)
+        else:
+            connection.close()
+
+    def get(
+        self, url: str, headers: dict[str, str] | None = None
+    ) -> tuple[int, bytes]:
+        with self.fetch(url, headers=headers) as response:
+            return response.status, response.read()
+
+    def head(self, url: str, headers: dict[str, str] | None = None) -> int:
+        with self.fetch(url, method="HEAD", headers=headers) as response:
+            response.read()
+            return response.status
+
+    def _acquire(
+        self, key: tuple[str, str]
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _release(
+        self, key: tuple[str, str], connection: http.client.HTTPConnection
+    ) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(connection)
+
+    def _connect(self, key: tuple[str, str]) -> http.client.HTTPConnection:
+        scheme, netloc = key
+        logger.debug("Connecting to %s://%s...", scheme, netloc)
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+
+POOL = ConnectionPool()
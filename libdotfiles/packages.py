@@ -1,210 +1,621 @@
+import atexit
+import http.client
+import importlib
+import importlib.metadata
+import json
 import logging
-from functools import lru_cache
-
-from libdotfiles.util import has_executable, run
+import os
+import re
+import shutil
+import site
+import subprocess
+import sys
+import urllib.parse
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from libdotfiles import aio, net, pkgdb, trace
+from libdotfiles.cache import TTLCache
+from libdotfiles.util import has_executable, record_failure, run
 
 logger = logging.getLogger(__name__)
 
+# how long a remote index's answer holds: a package that is there stays there,
+# one that isn't may get published any day
+AVAILABLE_TTL = 7 * 24 * 3600
+UNAVAILABLE_TTL = 24 * 3600
+REMOTE_WORKERS = 8
+AUR_CHUNK = 100
+# a package manager asked about one name has no business taking longer
+QUERY_TIMEOUT = 60
+
+# what shows up as a span per installer when DOTFILES_TRACE is set
+TRACED_METHODS = (
+    "read_installed_versions",
+    "read_available_versions",
+    "has_installed",
+    "is_available",
+    "prefetch_available",
+    "install_many",
+)
+
+# read_installed_versions, for a python3 that isn't us
+PIP_INVENTORY_SCRIPT = (
+    "import importlib.metadata, json;"
+    "print(json.dumps({d.metadata['Name']: d.version"
+    " for d in importlib.metadata.distributions() if d.metadata['Name']}))"
+)
+
+
+def normalize_pip_name(name: str) -> str:
+    """PEP 503: PyYAML, pyyaml and py_yaml are all one package."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+class RemoteIndex:
+    """What a remote index said about each package, remembered between runs.
+
+    ask takes the names nobody has cached an answer for and returns the ones
+    it could answer; a name it couldn't answer stays unknown, and uncached.
+    """
+
+    def __init__(
+        self, name: str, ask: Callable[[list[str]], dict[str, bool]]
+    ) -> None:
+        self.cache = TTLCache(name)
+        self.ask = ask
+
+    def prefetch(self, packages: list[str]) -> None:
+        missing = [
+            package
+            for package in dict.fromkeys(packages)
+            if self.cache.get(package) is None
+        ]
+        if not missing:
+            return
+        for package, available in self.ask(missing).items():
+            self.cache.set(
+                package,
+                available,
+                AVAILABLE_TTL if available else UNAVAILABLE_TTL,
+            )
+        self.cache.save()
+
+    def is_available(self, package: str) -> bool | None:
+        self.prefetch([package])
+        answer = self.cache.get(package)
+        return None if answer is None else bool(answer)
+
 
 class PackageInstaller:
     name: str = NotImplemented
 
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        for method in TRACED_METHODS:
+            owner = next(base for base in cls.__mro__ if method in vars(base))
+            if owner not in (cls, PackageInstaller):
+                continue  # a parent installer already wrapped it
+            setattr(
+                cls,
+                method,
+                trace.traced(f"{cls.name}.{method}", "packages")(
+                    getattr(cls, method)
+                ),
+            )
+
+    def __init__(self) -> None:
+        # "installed"/"available" -> name -> version, each read once per run
+        self._indices: dict[str, dict[str, str]] = {}
+        # same keys, for what the package manager said when we couldn't
+        self._answers: dict[str, dict[str, bool]] = {}
+
     @property
     def is_supported(self) -> bool:
         raise NotImplementedError("not implemented")
 
+    def read_installed_versions(self) -> dict[str, str]:
+        """Name -> version, read in-process; OSError if we can't."""
+        raise OSError("no database reader")
+
+    def read_available_versions(self) -> dict[str, str]:
+        """Same as read_installed_versions, for what the repos offer."""
+        raise OSError("no database reader")
+
+    def get_installed_versions(self) -> dict[str, str] | None:
+        """The read_installed_versions index, built once per run.
+
+        None when the database can't be read, in which case has_installed
+        falls back to asking the package manager.
+        """
+        return self._get_index("installed", self.read_installed_versions)
+
+    def get_available_versions(self) -> dict[str, str] | None:
+        return self._get_index("available", self.read_available_versions)
+
+    def _get_index(
+        self, kind: str, reader: Callable[[], dict[str, str]]
+    ) -> dict[str, str] | None:
+        if kind not in self._indices:
+            try:
+                self._indices[kind] = reader()
+            except (OSError, ValueError) as ex:
+                logger.debug("Can't read %s %s index: %s", self.name, kind, ex)
+                return None
+        return self._indices[kind]
+
+    def invalidate_installed_versions(self) -> None:
+        self._indices.pop("installed", None)
+        self._answers.pop("installed", None)
+
+    def normalize(self, package: str) -> str:
+        """The spelling the database and the answers go by."""
+        return package
+
     def has_installed(self, package: str) -> bool:
-        raise NotImplementedError("not implemented")
+        package = self.normalize(package)
+        installed = self.get_installed_versions()
+        if installed is not None:
+            return package in installed
+        return self.query_installed(package)
 
     def is_available(self, package: str) -> bool:
+        available = self.get_available_versions()
+        if available is not None:
+            return package in available
+        return self.query_available(package)
+
+    def query_installed(self, package: str) -> bool:
+        query_many("installed", [(self, package)])
+        return self._answers["installed"][self.normalize(package)]
+
+    def query_available(self, package: str) -> bool:
+        query_many("available", [(self, package)])
+        return self._answers["available"][self.normalize(package)]
+
+    def query_installed_command(self, package: str) -> list[Any]:
+        """What exits with 0 if package is installed, without a database."""
         raise NotImplementedError("not implemented")
 
-    def install(self, package: str) -> bool:
+    def query_available_command(self, package: str) -> list[Any]:
         raise NotImplementedError("not implemented")
 
+    def prefetch_available(self, packages: list[str]) -> None:
+        """Get ready to answer is_available for all of these at once."""
+        if self.get_available_versions() is None:
+            query_many("available", [(self, package) for package in packages])
+
+    def install_command(self, packages: list[str]) -> list[Any]:
+        raise NotImplementedError("not implemented")
+
+    def install(self, package: str) -> bool:
+        return self.install_many([package])[package]
+
+    def install_many(self, packages: list[str]) -> dict[str, bool]:
+        """Install packages in one transaction and say which of them made it.
+
+        A failed transaction installs nothing on pacman and some unknown part
+        on apt, so ask the database what is there now and retry the rest one
+        at a time; that pins the failure on the packages that caused it.
+        """
+        # whatever got pulled in, the index no longer describes it
+        self.invalidate_installed_versions()
+        command = self.install_command(packages)
+        # the one thing here that changes the system, so the one that waits
+        # for its turn at it
+        if run(command, exclusive=True, check=False).returncode == 0:
+            return dict.fromkeys(packages, True)
+        if len(packages) == 1:
+            return {packages[0]: False}
+        logger.warning(
+            "Installing %d packages with %s failed, retrying one by one...",
+            len(packages),
+            self.name,
+        )
+        self.invalidate_installed_versions()
+        return {
+            package: self.has_installed(package) or self.install(package)
+            for package in packages
+        }
+
 
 class AptPackageInstaller(PackageInstaller):
     name = "apt"
 
+    def __init__(
+        self,
+        status_path: Path = pkgdb.DPKG_STATUS_PATH,
+        lists_dir: Path = pkgdb.APT_LISTS_DIR,
+    ) -> None:
+        super().__init__()
+        self.status_path = status_path
+        self.lists_dir = lists_dir
+
     @property
     def is_supported(self) -> bool:
         return has_executable("apt")
 
-    def has_installed(self, package: str) -> bool:
-        return (
-            run(
-                ["dpkg", "-l", package], check=False, capture_output=True
-            ).returncode
-            == 0
-        )
+    def read_installed_versions(self) -> dict[str, str]:
+        return pkgdb.read_dpkg_status(self.status_path)
 
-    def is_available(self, package: str) -> bool:
-        return (
-            run(
-                ["apt", "show", package], check=False, capture_output=True
-            ).returncode
-            == 0
-        )
+    def read_available_versions(self) -> dict[str, str]:
+        return pkgdb.read_apt_lists(self.lists_dir)
 
-    def install(self, package: str) -> bool:
-        return (
-            run(
-                ["sudo", "-S", "apt", "install", "-y", package], check=False
-            ).returncode
-            == 0
-        )
+    def query_installed_command(self, package: str) -> list[Any]:
+        return ["dpkg", "-l", package]
+
+    def query_available_command(self, package: str) -> list[Any]:
+        return ["apt", "show", package]
+
+    def install_command(self, packages: list[str]) -> list[Any]:
+        return ["sudo", "-S", "apt", "install", "-y", *packages]
 
 
 class PacmanPackageInstaller(PackageInstaller):
     name = "pacman"
 
+    def __init__(self, db_dir: Path = pkgdb.PACMAN_DB_DIR) -> None:
+        super().__init__()
+        self.db_dir = db_dir
+
     @property
     def is_supported(self) -> bool:
         return has_executable("pacman") and has_executable("sudo")
 
-    def has_installed(self, package: str) -> bool:
-        return (
-            run(
-                ["pacman", "-Q", package], check=False, capture_output=True
-            ).returncode
-            == 0
-        )
+    def read_installed_versions(self) -> dict[str, str]:
+        return pkgdb.read_pacman_local(self.db_dir)
 
-    def is_available(self, package: str) -> bool:
-        return (
-            run(
-                ["pacman", "-Ss", package], check=False, capture_output=True
-            ).returncode
-            == 0
-        )
+    def read_available_versions(self) -> dict[str, str]:
+        return pkgdb.read_pacman_sync(self.db_dir)
 
-    def install(self, package: str) -> bool:
-        return (
-            run(
-                ["sudo", "-S", "pacman", "-S", package, "--noconfirm"],
-                check=False,
-            ).returncode
-            == 0
-        )
+    def query_installed_command(self, package: str) -> list[Any]:
+        return ["pacman", "-Q", package]
+
+    def query_available_command(self, package: str) -> list[Any]:
+        return ["pacman", "-Ss", package]
+
+    def install_command(self, packages: list[str]) -> list[Any]:
+        return ["sudo", "-S", "pacman", "-S", *packages, "--noconfirm"]
 
 
 class PacaurPackageInstaller(PackageInstaller):
     name = "pacaur"
 
+    # pacaur installs through pacman, so -Q reads the same local database
+    def __init__(
+        self,
+        db_dir: Path = pkgdb.PACMAN_DB_DIR,
+        rpc_url: str = "https://aur.archlinux.org/rpc/v5/info",
+        pool: net.ConnectionPool = net.POOL,
+    ) -> None:
+        super().__init__()
+        self.db_dir = db_dir
+        self.rpc_url = rpc_url
+        self.pool = pool
+        self.remote = RemoteIndex("aur", self.ask_aur)
+
     @property
     def is_supported(self) -> bool:
         return has_executable("pacaur")
 
-    def has_installed(self, package: str) -> bool:
-        return (
-            run(
-                ["pacaur", "-Q", package], check=False, capture_output=True
-            ).returncode
-            == 0
-        )
+    def read_installed_versions(self) -> dict[str, str]:
+        return pkgdb.read_pacman_local(self.db_dir)
 
-    def is_available(self, package: str) -> bool:
-        return (
-            run(
-                ["pacaur", "-Ss", package], check=False, capture_output=True
-            ).returncode
-            == 0
-        )
+    def query_installed_command(self, package: str) -> list[Any]:
+        return ["pacaur", "-Q", package]
 
-    def install(self, package: str) -> bool:
-        return (
-            run(
-                ["pacaur", "-S", package, "--noconfirm", "--noedit"],
-                check=False,
-            ).returncode
-            == 0
-        )
+    def is_available(self, package: str) -> bool:
+        available = self.remote.is_available(package)
+        if available is None:
+            return self.query_available(package)
+        return available
+
+    def prefetch_available(self, packages: list[str]) -> None:
+        self.remote.prefetch(packages)
+
+    def ask_aur(self, packages: list[str]) -> dict[str, bool]:
+        """One info request per hundred names, instead of a search each."""
+        answers: dict[str, bool] = {}
+        for start in range(0, len(packages), AUR_CHUNK):
+            chunk = packages[start : start + AUR_CHUNK]
+            query = urllib.parse.urlencode([("arg[]", name) for name in chunk])
+            try:
+                status, body = self.pool.get(f"{self.rpc_url}?{query}")
+                if status != 200:
+                    raise ValueError(f"HTTP {status}")
+                found = {
+                    result["Name"] for result in json.loads(body)["results"]
+                }
+            except (
+                OSError,
+                http.client.HTTPException,
+                ValueError,
+                KeyError,
+            ) as ex:
+                logger.warning("Can't ask the AUR about %s: %s", chunk, ex)
+                continue
+            answers.update({name: name in found for name in chunk})
+        return answers
+
+    def query_available_command(self, package: str) -> list[Any]:
+        return ["pacaur", "-Ss", package]
+
+    def install_command(self, packages: list[str]) -> list[Any]:
+        return ["pacaur", "-S", *packages, "--noconfirm", "--noedit"]
 
 
 class PipPackageInstaller(PackageInstaller):
     name = "pip"
 
+    def __init__(
+        self,
+        project_url: str = "https://pypi.org/project/{}/",
+        pool: net.ConnectionPool = net.POOL,
+    ) -> None:
+        super().__init__()
+        self.project_url = project_url
+        self.pool = pool
+        self.remote = RemoteIndex("pypi", self.ask_pypi)
+
     @property
     def is_supported(self) -> bool:
         return has_executable("python3")
 
-    @lru_cache
-    def get_installed_packages(self) -> list[tuple[str, str, str | None]]:
-        output = run(
-            ["python3", "-m", "pip", "list"],
-            check=False,
-            text=True,
-            capture_output=True,
-        ).stdout
-        ret = []
-        for line in output.splitlines()[2:]:
-            if line:
-                result = line.split(maxsplit=2)
-                if len(result) == 2:
-                    package, version = result
-                    location = None
-                elif len(result) == 3:
-                    package, version, location = result
-                else:
-                    raise RuntimeError("unexpected output")
-                ret.append((package, version, location))
-        return ret
-
-    def has_installed(self, package: str) -> bool:
-        return any(
-            other_package == package
-            for (
-                other_package,
-                _other_version,
-                _other_location,
-            ) in self.get_installed_packages()
-        )
+    def read_installed_versions(self) -> dict[str, str]:
+        """Normalized name -> version for what python3 can import.
+
+        pip list costs a second of importing pip to print a table, so read
+        the dist-info directories ourselves. That needs us to be the python3
+        pip installs for; when we aren't, ask that one to read them instead.
+        """
+        python3 = shutil.which("python3")
+        if python3 is None or not os.path.samefile(python3, sys.executable):
+            try:
+                output = run(
+                    ["python3", "-c", PIP_INVENTORY_SCRIPT],
+                    exclusive=False,
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+            except subprocess.CalledProcessError as ex:
+                raise OSError(f"can't list python3's packages: {ex}") from ex
+            versions: dict[str, str] = json.loads(output)
+        else:
+            # a user site that didn't exist when we started isn't on sys.path
+            # yet, but it is where install() puts things
+            importlib.invalidate_caches()
+            path = [*sys.path, site.getusersitepackages()]
+            versions = {
+                dist.metadata["Name"]: dist.version
+                for dist in importlib.metadata.distributions(path=path)
+                if dist.metadata["Name"]
+            }
+        return {
+            normalize_pip_name(name): version
+            for name, version in versions.items()
+        }
+
+    def normalize(self, package: str) -> str:
+        return normalize_pip_name(package)
+
+    def query_installed_command(self, package: str) -> list[Any]:
+        return ["python3", "-m", "pip", "show", package]
 
     def is_available(self, package: str) -> bool:
-        import urllib.request
-
-        request = urllib.request.Request(
-            f"https://pypi.org/project/{package}/", method="HEAD"
-        )
+        return bool(self.remote.is_available(package))
+
+    def prefetch_available(self, packages: list[str]) -> None:
+        self.remote.prefetch(packages)
+
+    def ask_pypi(self, packages: list[str]) -> dict[str, bool]:
+        """PyPI has no batch lookup, so HEAD the project pages side by side."""
+        with ThreadPoolExecutor(REMOTE_WORKERS) as executor:
+            answers = dict(zip(packages, executor.map(self._head, packages)))
+        return {
+            package: answer
+            for package, answer in answers.items()
+            if answer is not None
+        }
+
+    def _head(self, package: str) -> bool | None:
         try:
-            urllib.request.urlopen(request)
-        except urllib.error.HTTPError:
+            status = self.pool.head(self.project_url.format(package))
+        except (OSError, http.client.HTTPException) as ex:
+            logger.warning("Can't ask PyPI about %s: %s", package, ex)
+            return None
+        if status == 404:
             return False
-        else:
-            return True
+        # a redirect to the canonical spelling of the name counts as found
+        return True if status < 400 else None
 
-    def install(self, package: str) -> bool:
-        command = [
+    def install_command(self, packages: list[str]) -> list[Any]:
+        return [
             "python3",
             "-m",
             "pip",
             "install",
             "--user",
             "--break-system-packages",
-            package,
+            *packages,
         ]
-        return run(command, check=False).returncode == 0
+
+
+def query_many(
+    kind: str, questions: list[tuple[PackageInstaller, str]]
+) -> None:
+    """Ask package managers about packages, all the questions side by side.
+
+    kind is "installed" or "available". For installers whose database we
+    can't read, where every answer is a command of its own; the answers land
+    where has_installed and is_available look for them.
+    """
+    pending: dict[tuple[PackageInstaller, str], list[Any]] = {}
+    for installer, package in questions:
+        package = installer.normalize(package)
+        if package in installer._answers.get(kind, {}):
+            continue
+        if kind == "installed":
+            command = installer.query_installed_command(package)
+        else:
+            command = installer.query_available_command(package)
+        pending[installer, package] = command
+    # queries only read, so they needn't wait for whatever is installing
+    results = aio.run_many(
+        list(pending.values()), timeout=QUERY_TIMEOUT, exclusive=False
+    )
+    for (installer, package), result in zip(pending, results):
+        answers = installer._answers.setdefault(kind, {})
+        answers[package] = result.returncode == 0 and not result.timed_out
 
 
 INSTALLERS = [cls() for cls in PackageInstaller.__subclasses__()]
 
+# how many batched() blocks we are in; DOTFILES_BATCH_INSTALL makes the whole
+# process one batch, installed when it exits
+_batch_depth = 1 if os.environ.get("DOTFILES_BATCH_INSTALL") else 0
+# what try_install() queued under batched(), for flush() to install
+_pending: list[tuple[str, str | None]] = []
+
 
-def try_install(package: str, method: str | None = None) -> bool:
+@contextmanager
+def batched() -> Iterator[None]:
+    """Queue the try_install()s in the block and install them on the way out.
+
+    One `pacman -S a b c` resolves dependencies, takes the database lock and
+    asks sudo once, where a transaction per package pays for all three each
+    time. Pass now=True for a package the block itself needs right away.
+    """
+    global _batch_depth
+    _batch_depth += 1
     try:
-        return install(package, method)
+        yield
+    finally:
+        _batch_depth -= 1
+        if not _batch_depth:
+            flush()
+
+
+@atexit.register
+@trace.traced("flush", "packages")
+def flush() -> dict[str, bool]:
+    """Install everything queued so far, one transaction per installer."""
+    pending = list(dict.fromkeys(_pending))
+    _pending.clear()
+    results: dict[str, bool] = {}
+    for installer, packages in _assign_installers(pending, results).items():
+        logger.info(
+            "Installing %s with %s...", ", ".join(packages), installer.name
+        )
+        for package, success in installer.install_many(packages).items():
+            if not success:
+                logger.error(
+                    "Error installing %s with %s", package, installer.name
+                )
+            results[package] = success
+    for package, success in results.items():
+        if not success:
+            record_failure(f"installing {package} failed")
+    return results
+
+
+def _assign_installers(
+    pending: list[tuple[str, str | None]], results: dict[str, bool]
+) -> dict[PackageInstaller, list[str]]:
+    """Pick an installer for each package the way install() would.
+
+    Installer by installer rather than package by package, so one that asks a
+    remote index can ask about all of its candidates at once. What can't be
+    installed at all goes into results as a failure.
+    """
+    _prefetch_installed(pending)
+    unresolved: list[tuple[str, str | None]] = []
+    for package, method in pending:
+        try:
+            if has_installed(package, method):
+                logger.info("Package %s is already installed.", package)
+                results[package] = True
+                continue
+        except RuntimeError as ex:
+            logger.error("Error installing %s: %s", package, ex)
+            results[package] = False
+            continue
+        unresolved.append((package, method))
+
+    assigned: dict[PackageInstaller, list[str]] = {}
+    for installer in INSTALLERS:
+        candidates = [
+            (package, method)
+            for package, method in unresolved
+            if method in (None, installer.name)
+        ]
+        if not candidates or not installer.is_supported:
+            continue
+        installer.prefetch_available([package for package, _ in candidates])
+        for package, method in candidates:
+            if installer.is_available(package):
+                assigned.setdefault(installer, []).append(package)
+                unresolved.remove((package, method))
+
+    for package, method in unresolved:
+        logger.error(
+            "Error installing %s: %s is not capable of installing it",
+            package,
+            method or "no package manager",
+        )
+        results[package] = False
+    return assigned
+
+
+def try_install(
+    package: str, method: str | None = None, now: bool = False
+) -> bool:
+    try:
+        return install(package, method, now=now)
     except Exception as ex:
         logger.error("Error installing %s: %s", package, ex)
+        record_failure(f"installing {package} failed")
         return False
 
 
 def has_installed(package: str, method: str | None = None) -> bool:
     chosen_installers = _choose_installers(method)
+    # whichever of them have to ask a command, ask all at once
+    _prefetch_installed([(package, method)])
     return any(
         installer.has_installed(package) for installer in chosen_installers
     )
 
 
-def install(package: str, method: str | None = None) -> bool:
+def _prefetch_installed(packages: list[tuple[str, str | None]]) -> None:
+    questions: list[tuple[PackageInstaller, str]] = []
+    for installer in INSTALLERS:
+        if not installer.is_supported:
+            continue
+        if installer.get_installed_versions() is not None:
+            continue
+        questions.extend(
+            (installer, package)
+            for package, method in packages
+            if method in (None, installer.name)
+        )
+    query_many("installed", questions)
+
+
+def install(
+    package: str, method: str | None = None, now: bool = False
+) -> bool:
+    """Install package, or under batched() queue it unless now is set.
+
+    A queued package counts as a success here; flush() reports how it went.
+    """
+    if _batch_depth and not now:
+        logger.info("Package %s queued for installation.", package)
+        _pending.append((package, method))
+        return True
     if has_installed(package, method):
         logger.info("Package %s is already installed.", package)
         return True
@@ -216,7 +627,10 @@ def install(package: str, method: str | None = None) -> bool:
                 package,
                 installer.name,
             )
-            return installer.install(package)
+            if not installer.install(package):
+                record_failure(f"installing {package} failed")
+                return False
+            return True
     if method is None:
         raise RuntimeError(
             f"No package manager is capable of installing {package}"
@@ -0,0 +1,156 @@
+"""Read package databases straight off disk instead of asking their tools.
+
+A bootstrap asks whether a package is installed a few hundred times, and
+forking dpkg or pacman for each answer costs more than the rest of the run.
+Both keep their answer in plain files; parse those once and look names up.
+"""
+
+import gzip
+import lzma
+import os
+import re
+import tarfile
+import zlib
+from pathlib import Path
+
+DPKG_STATUS_PATH = Path("/var/lib/dpkg/status")
+APT_LISTS_DIR = Path("/var/lib/apt/lists")
+PACMAN_DB_DIR = Path("/var/lib/pacman")
+
+APT_FIELD = re.compile(rb"^(Package|Version): *(\S+)", re.MULTILINE)
+
+# what a file cut short by an interrupted update raises on the way out of its
+# compression, besides OSError; callers only expect OSError and fall back to
+# asking the package manager
+CORRUPT = (EOFError, zlib.error, lzma.LZMAError)
+
+
+def read_dpkg_status(path: Path = DPKG_STATUS_PATH) -> dict[str, str]:
+    """Installed package name -> version, from dpkg's status file.
+
+    Only stanzas dpkg considers installed count: a removed package keeps its
+    stanza around as "deinstall ok config-files" until it is purged.
+    """
+    installed: dict[str, str] = {}
+    with path.open(encoding="utf-8", errors="replace") as handle:
+        for stanza in handle.read().split("\n\n"):
+            fields: dict[str, str] = {}
+            for line in stanza.splitlines():
+                if not line or line[0] in " \t":
+                    continue  # continuation of a multi-line field
+                key, _, value = line.partition(":")
+                fields[key] = value.strip()
+            name = fields.get("Package")
+            if not name or not fields.get("Status", "").endswith(" installed"):
+                continue
+            version = fields.get("Version", "")
+            installed[name] = version
+            # dpkg -l answers to the arch-qualified name too
+            if arch := fields.get("Architecture"):
+                installed[f"{name}:{arch}"] = version
+    return installed
+
+
+def read_pacman_local(db_dir: Path = PACMAN_DB_DIR) -> dict[str, str]:
+    """Installed package name -> version, from pacman's local database.
+
+    Every installed package is a `<name>-<pkgver>-<pkgrel>` directory, and
+    neither pkgver nor pkgrel may contain a dash, so the listing alone is
+    enough; the desc files inside never need opening.
+    """
+    installed: dict[str, str] = {}
+    with os.scandir(db_dir / "local") as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue  # ALPM_DB_VERSION
+            parts = entry.name.rsplit("-", 2)
+            if len(parts) != 3:
+                continue
+            name, pkgver, pkgrel = parts
+            installed[name] = f"{pkgver}-{pkgrel}"
+    return installed
+
+
+def read_apt_lists(lists_dir: Path = APT_LISTS_DIR) -> dict[str, str]:
+    """Package name -> version, for everything apt update last fetched.
+
+    Only two fields matter and the lists run to tens of megabytes, so pick
+    them out with one regex per file instead of splitting every stanza.
+    """
+    available: dict[str, str] = {}
+    paths = sorted(lists_dir.glob("*_Packages*"))
+    if not paths:
+        raise OSError(f"no package lists in {lists_dir}")
+    for path in paths:
+        try:
+            if path.suffix == ".gz":
+                data = gzip.decompress(path.read_bytes())
+            elif path.suffix == ".xz":
+                data = lzma.decompress(path.read_bytes())
+            elif path.name.endswith("_Packages"):
+                data = path.read_bytes()
+            else:
+                continue  # .lz4 and friends; apt keeps them only when told to
+        except CORRUPT as ex:
+            raise OSError(f"{path}: {ex or type(ex).__name__}") from ex
+        name = None
+        for match in APT_FIELD.finditer(data):
+            if match[1] == b"Package":
+                name = match[2].decode()
+                available.setdefault(name, "")
+            elif name is not None:
+                available[name] = available[name] or match[2].decode()
+                name = None
+    return available
+
+
+def read_pacman_sync(db_dir: Path = PACMAN_DB_DIR) -> dict[str, str]:
+    """Package, group or provided name -> version, across the sync repos.
+
+    pacman -S takes a group or anything some package provides as well as a
+    package name, so those count too; a group maps to an empty version.
+    """
+    available: dict[str, str] = {}
+    paths = sorted((db_dir / "sync").glob("*.db"))
+    if not paths:
+        raise OSError(f"no sync databases in {db_dir / 'sync'}")
+    for path in paths:
+        try:
+            available.update(_read_sync_db(path))
+        except (tarfile.TarError, *CORRUPT) as ex:
+            raise OSError(f"{path}: {ex or type(ex).__name__}") from ex
+    return available
+
+
+def _read_sync_db(path: Path) -> dict[str, str]:
+    available: dict[str, str] = {}
+    with tarfile.open(path) as archive:
+        for member in archive:
+            if not member.name.endswith("/desc"):
+                continue
+            handle = archive.extractfile(member)
+            if handle is None:
+                continue
+            desc = _parse_desc(handle.read().decode("utf-8", "replace"))
+            version = desc.get("VERSION", [""])[0]
+            for name in desc.get("NAME", []):
+                available[name] = version
+            for group in desc.get("GROUPS", []):
+                available.setdefault(group, "")
+            for provided in desc.get("PROVIDES", []):
+                name, _, provided_version = provided.partition("=")
+                available.setdefault(name, provided_version)
+    return available
+
+
+def _parse_desc(text: str) -> dict[str, list[str]]:
+    """pacman's %FIELD% blocks, each a list of lines."""
+    fields: dict[str, list[str]] = {}
+    key = None
+    for line in text.splitlines():
+        if line.startswith("%") and line.endswith("%"):
+            key = line.strip("%")
+            fields[key] = []
+        elif line and key is not None:
+            fields[key].append(line)
+    return fields
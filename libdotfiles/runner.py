@@ -0,0 +1,388 @@
+"""Install cfg modules side by side, each after the modules it needs.
+
+./install used to run one `python3 -m cfg.<name>` at a time, so a bootstrap
+took as long as every module's downloads, clones and package queries added
+up. Most modules have nothing to do with each other; run those at once and
+order only the ones that do, so a machine takes as long as its slowest chain.
+
+A module's dependencies are what its cfg/<name>/__init__.py says in DEPENDS,
+plus every other cfg.<name> its __main__.py mentions. INTERACTIVE = True there
+means the module wants the terminal to itself, so nothing runs beside it.
+INPUTS lists glob patterns, relative to cfg, for files outside its own
+directory that it reads, so that changing one runs it again. What can't run
+side by side inside modules - the package database lock and sudo's prompt -
+libdotfiles.util.run serializes across processes.
+
+A module that ran before, whose inputs are unchanged and whose outputs are
+still in place, is skipped; see libdotfiles.state. --force runs it anyway and
+--explain says what made each module run.
+
+--trace FILE records where the time went, down to each subprocess, download
+and package query, as a Chrome trace in FILE; see libdotfiles.trace.
+"""
+
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from libdotfiles import state, trace
+from libdotfiles.util import (
+    LOCK_DIR_ENV,
+    OUTPUTS_ENV,
+    REPO_ROOT_DIR,
+    has_executable,
+)
+
+CFG_DIR = REPO_ROOT_DIR / "cfg"
+MODULE_REFERENCE = re.compile(r"\bcfg\.(\w+)")
+
+# modules wait on the network and on each other's locks, not on the CPU
+DEFAULT_JOBS = 8
+# how often to refresh sudo's timestamp so no module is left at a prompt
+SUDO_KEEPALIVE = 60
+
+
+@dataclass
+class Module:
+    name: str
+    depends: set[str] = field(default_factory=set)
+    interactive: bool = False
+    inputs: list[str] = field(default_factory=list)
+    fingerprint: str = ""
+
+
+def normalize_name(name: str) -> str:
+    """What ./install always took: zsh, cfg/zsh/ and cfg.zsh are one."""
+    name = name.strip("/").replace("/", ".")
+    return name.removeprefix("cfg.")
+
+
+def all_module_names() -> list[str]:
+    return sorted(path.parent.name for path in CFG_DIR.glob("*/__main__.py"))
+
+
+def read_module(name: str) -> Module:
+    path = CFG_DIR / name
+    if not (path / "__main__.py").exists():
+        raise RuntimeError(f"No such module: {name}")
+    module = Module(name)
+
+    # read the declarations rather than import them, so no module's code runs
+    # before its turn
+    init_path = path / "__init__.py"
+    if init_path.exists():
+        for node in ast.parse(init_path.read_text()).body:
+            if not isinstance(node, ast.Assign):
+                continue
+            for target in node.targets:
+                if not isinstance(target, ast.Name):
+                    continue
+                if target.id == "DEPENDS":
+                    module.depends.update(
+                        map(normalize_name, ast.literal_eval(node.value))
+                    )
+                elif target.id == "INTERACTIVE":
+                    module.interactive = bool(ast.literal_eval(node.value))
+                elif target.id == "INPUTS":
+                    module.inputs.extend(ast.literal_eval(node.value))
+
+    module.depends.update(
+        MODULE_REFERENCE.findall((path / "__main__.py").read_text())
+    )
+    module.depends.discard(name)
+    return module
+
+
+def resolve(names: list[str]) -> dict[str, Module]:
+    """The modules asked for and everything they need, checked for cycles."""
+    modules: dict[str, Module] = {}
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name not in modules:
+            modules[name] = read_module(name)
+            todo.extend(modules[name].depends)
+
+    done: set[str] = set()
+    visiting: list[str] = []
+
+    def visit(name: str) -> None:
+        if name in done:
+            return
+        if name in visiting:
+            cycle = visiting[visiting.index(name) :] + [name]
+            raise RuntimeError(f"Dependency cycle: {' -> '.join(cycle)}")
+        visiting.append(name)
+        for dependency in modules[name].depends:
+            visit(dependency)
+        visiting.pop()
+        done.add(name)
+
+    for name in modules:
+        visit(name)
+    return modules
+
+
+def fingerprint(modules: dict[str, Module], name: str) -> str:
+    """libdotfiles.state's fingerprint over a module and all it depends on."""
+    names = {name}
+    todo = [name]
+    while todo:
+        for dependency in modules[todo.pop()].depends - names:
+            names.add(dependency)
+            todo.append(dependency)
+    return state.fingerprint(
+        [CFG_DIR / other for other in names],
+        [
+            path
+            for other in names
+            for pattern in modules[other].inputs
+            for path in CFG_DIR.glob(pattern)
+            if path.is_file()
+        ],
+    )
+
+
+class Scheduler:
+    """Start every module whose dependencies are done, up to jobs at once."""
+
+    def __init__(
+        self,
+        modules: dict[str, Module],
+        jobs: int,
+        work_dir: Path,
+        results: dict[str, int | None],
+    ) -> None:
+        self.modules = modules
+        self.jobs = max(1, jobs)
+        self.work_dir = work_dir
+        self.results = results  # None: skipped
+        self.running: set[str] = set()
+        self.condition = threading.Condition()
+        self.output_lock = threading.Lock()
+
+    def run(self) -> dict[str, int | None]:
+        with self.condition:
+            while len(self.results) < len(self.modules):
+                if self._start_ready():
+                    continue
+                if not self.running:
+                    break  # nothing left that can ever become ready
+                self.condition.wait()
+        return self.results
+
+    def _start_ready(self) -> bool:
+        """Start what can start; True if anything started or got skipped."""
+        started = False
+        for name, module in sorted(self.modules.items()):
+            if name in self.results or name in self.running:
+                continue
+            failed = [
+                dependency
+                for dependency in module.depends
+                if dependency in self.results and self.results[dependency] != 0
+            ]
+            if failed:
+                self._report(name, f"skipped, {', '.join(failed)} failed", "")
+                self.results[name] = None
+                started = True  # the result changed what else is ready
+                continue
+            if any(
+                dependency not in self.results for dependency in module.depends
+            ):
+                continue
+            if any(self.modules[other].interactive for other in self.running):
+                break
+            if module.interactive and self.running:
+                continue
+            if len(self.running) >= self.jobs:
+                break
+            self.running.add(name)
+            threading.Thread(
+                target=self._run_module, args=(module,), daemon=True
+            ).start()
+            started = True
+        return started
+
+    def _run_module(self, module: Module) -> None:
+        with trace.span(module.name, "module") as record:
+            returncode = self._run_module_process(module)
+            record["returncode"] = returncode
+        with self.condition:
+            self.running.discard(module.name)
+            self.results[module.name] = returncode
+            self.condition.notify_all()
+
+    def _run_module_process(self, module: Module) -> int:
+        start = time.monotonic()
+        command = [sys.executable, "-m", f"cfg.{module.name}"]
+        outputs_path = self.work_dir / f"{module.name}.outputs.json"
+        env = {**os.environ, OUTPUTS_ENV: str(outputs_path)}
+        if module.interactive:
+            with self.output_lock:
+                print(f"==> {module.name}", flush=True)
+                returncode = subprocess.run(
+                    command, cwd=REPO_ROOT_DIR, env=env, check=False
+                ).returncode
+            output = ""
+        else:
+            # keep each module's output in one piece instead of interleaved
+            # with every other module's
+            process = subprocess.run(
+                command,
+                cwd=REPO_ROOT_DIR,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                errors="replace",
+                check=False,
+            )
+            returncode = process.returncode
+            output = process.stdout
+        recorded: dict[str, list[Any]] = {}
+        if returncode == 0:
+            try:
+                recorded = json.loads(outputs_path.read_text())
+            except (OSError, ValueError):
+                pass
+        failures = recorded.get("failures", [])
+        if returncode == 0 and not failures:
+            state.save(
+                module.name, module.fingerprint, recorded.get("outputs", [])
+            )
+        else:
+            state.forget(module.name)
+        if returncode:
+            status = f"failed ({returncode})"
+        elif failures:
+            # saved as not done, so the next run tries again
+            status = f"done with failures ({'; '.join(failures)})"
+        else:
+            status = "done"
+        elapsed = time.monotonic() - start
+        self._report(module.name, f"{status} in {elapsed:.1f} s", output)
+        return returncode
+
+    def _report(self, name: str, status: str, output: str) -> None:
+        with self.output_lock:
+            if output:
+                print(f"==> {name}", flush=True)
+                sys.stdout.write(output)
+            print(f"==> {name}: {status}", flush=True)
+
+
+def keep_sudo_alive(stop: threading.Event) -> None:
+    """Keep the password main() asked for fresh until stop is set.
+
+    Modules running side by side have no terminal to prompt on.
+    """
+    while not stop.wait(SUDO_KEEPALIVE):
+        subprocess.run(["sudo", "-n", "-v"], check=False)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Install cfg modules, side by side where they allow it."
+    )
+    parser.add_argument(
+        "modules", nargs="+", metavar="module", help="module name, or all"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help="how many modules to run at once",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="run modules even if nothing changed since they last ran",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="say why each module runs or gets skipped",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        metavar="FILE",
+        help="write a Chrome trace of the run to FILE and print a summary",
+    )
+    args = parser.parse_args()
+
+    names = [normalize_name(name) for name in args.modules]
+    if "all" in names:
+        names = all_module_names()
+    try:
+        modules = resolve(names)
+    except RuntimeError as ex:
+        print(ex, file=sys.stderr)
+        return 1
+
+    results: dict[str, int | None] = {}
+    for name, module in sorted(modules.items()):
+        module.fingerprint = fingerprint(modules, name)
+        reason = (
+            "forced"
+            if args.force
+            else state.why_dirty(name, module.fingerprint)
+        )
+        if reason is None:
+            print(f"==> {name}: up to date")
+            results[name] = 0
+        elif args.explain:
+            print(f"==> {name}: will run, {reason}")
+
+    pending = [name for name in modules if name not in results]
+    if len(pending) == 1:
+        # one module keeps the terminal, as ./install always gave it
+        modules[pending[0]].interactive = True
+    elif sys.stdout.isatty():
+        os.environ.setdefault("COLORED_LOGS", "1")
+
+    stop = threading.Event()
+    with tempfile.TemporaryDirectory(prefix="dotfiles-") as work_dir:
+        os.environ[LOCK_DIR_ENV] = work_dir
+        trace_dir = Path(work_dir) / "trace"
+        if args.trace:
+            os.environ[trace.TRACE_ENV] = str(trace_dir)
+        if len(pending) > 1 and has_executable("sudo") and sys.stdin.isatty():
+            subprocess.run(["sudo", "-v"], check=False)
+            threading.Thread(
+                target=keep_sudo_alive, args=(stop,), daemon=True
+            ).start()
+        try:
+            Scheduler(modules, args.jobs, Path(work_dir), results).run()
+        finally:
+            stop.set()
+        if args.trace:
+            events = trace.load(trace_dir)
+            trace.export_chrome(events, args.trace)
+            print(trace.summarize(events))
+            print(f"Trace written to {args.trace}")
+            del os.environ[trace.TRACE_ENV]
+
+    failed = sorted(name for name, code in results.items() if code != 0)
+    if failed:
+        print(f"Failed or skipped: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Remember what each module did, so an unchanged one can be skipped.
+
+Re-running ./install on a provisioned machine redid every symlink, fc-cache,
+lesskey and PlugInstall. After a module succeeds the runner saves a fingerprint
+of what went into it - its cfg directory, the cfg directories of the modules it
+depends on, the files their INPUTS patterns match, and libdotfiles itself -
+next to the list of outputs it recorded through libdotfiles.util. A module that
+carried on past something it couldn't do, like a package that wouldn't install,
+isn't saved, so the next run retries. Next time, a module whose fingerprint
+matches and whose outputs are all still in place is done.
+"""
+
+import hashlib
+import json
+import os
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+from libdotfiles.util import LIBDOTFILES_DIR, STATE_DIR
+
+MODULES_STATE_DIR = STATE_DIR / "modules"
+
+# never an input, however much of it a run leaves behind
+IGNORED_NAMES = {"__pycache__", ".mypy_cache", ".ruff_cache"}
+
+
+def hash_tree(root: Path, digest: "hashlib._Hash") -> None:
+    """Feed every file under root into digest, names and contents both."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as scan:
+            entries = sorted(scan, key=lambda entry: entry.name)
+        for entry in entries:
+            if entry.name in IGNORED_NAMES:
+                continue
+            path = Path(entry.path)
+            digest.update(str(path.relative_to(root)).encode() + b"\0")
+            if entry.is_symlink():
+                digest.update(os.readlink(entry.path).encode() + b"\0")
+            elif entry.is_dir():
+                stack.append(path)
+            elif entry.is_file():
+                digest.update(path.read_bytes())
+
+
+def fingerprint(module_dirs: list[Path], files: Iterable[Path] = ()) -> str:
+    """Over the module directories and libdotfiles, then files one by one."""
+    digest = hashlib.sha256()
+    for path in [LIBDOTFILES_DIR, *sorted(module_dirs)]:
+        digest.update(path.name.encode() + b"\0")
+        hash_tree(path, digest)
+    for path in sorted(set(files)):
+        if IGNORED_NAMES.isdisjoint(path.parts):
+            digest.update(str(path).encode() + b"\0")
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def state_path(name: str) -> Path:
+    return MODULES_STATE_DIR / f"{name}.json"
+
+
+def load(name: str) -> dict[str, Any] | None:
+    try:
+        state: dict[str, Any] = json.loads(state_path(name).read_text())
+    except (OSError, ValueError):
+        return None
+    return state
+
+
+def save(name: str, digest: str, outputs: list[dict[str, str]]) -> None:
+    path = state_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # the same link made twice is one output
+    unique = list(
+        {
+            json.dumps(entry, sort_keys=True): entry for entry in outputs
+        }.values()
+    )
+    path.write_text(
+        json.dumps({"fingerprint": digest, "outputs": unique}, indent=2)
+    )
+
+
+def forget(name: str) -> None:
+    state_path(name).unlink(missing_ok=True)
+
+
+def verify_output(entry: dict[str, str]) -> str | None:
+    """Why this output is no longer what the module left, or None."""
+    path = entry["path"]
+    kind = entry["kind"]
+    if kind == "symlink":
+        source = entry["source"]
+        if not os.path.exists(path):
+            return f"{path} is gone"
+        if not os.path.samefile(path, source):
+            return f"{path} no longer links to {source}"
+    elif kind == "dir":
+        if not os.path.isdir(path):
+            return f"{path} is gone"
+    elif not os.path.exists(path):
+        return f"{path} is gone"
+    return None
+
+
+def why_dirty(name: str, digest: str) -> str | None:
+    """Why the module has to run again, or None if it can be skipped."""
+    state = load(name)
+    if state is None:
+        return "never installed"
+    if state.get("fingerprint") != digest:
+        return "inputs changed"
+    for entry in state.get("outputs", []):
+        if reason := verify_output(entry):
+            return reason
+    return None
@@ -0,0 +1,177 @@
+"""Where a bootstrap spends its time, span by span.
+
+Off unless DOTFILES_TRACE names a directory: then every process writes the
+spans it recorded - each cfg module, each util.run() subprocess, each
+download and each installer method - to <pid>.jsonl there when it exits.
+`./install --trace FILE` sets that up for all its modules and turns the
+result into a Chrome trace (chrome://tracing, ui.perfetto.dev) and a table;
+`python3 -m libdotfiles.trace DIR` does the same for spans from anywhere.
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, TypeVar
+
+TRACE_ENV = "DOTFILES_TRACE"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_spans: list[dict[str, Any]] = []
+_lock = threading.Lock()
+_collectors = 0
+
+
+def enabled() -> bool:
+    return _collectors > 0 or bool(os.environ.get(TRACE_ENV))
+
+
+@contextmanager
+def collect() -> Iterator[list[dict[str, Any]]]:
+    """Record spans in the block even with tracing off, into the list yielded.
+
+    For code that keeps its own timings: what DOTFILES_TRACE would write
+    still gets written, and nothing else does.
+    """
+    global _collectors
+    collected: list[dict[str, Any]] = []
+    with _lock:
+        start = len(_spans)
+        _collectors += 1
+    try:
+        yield collected
+    finally:
+        with _lock:
+            _collectors -= 1
+            collected.extend(_spans[start:])
+            if not os.environ.get(TRACE_ENV):
+                del _spans[start:]
+
+
+@contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+    """Time the block as one span; what it puts in the dict lands in args.
+
+    Yields a throwaway dict when tracing is off, so callers never check.
+    """
+    if not enabled():
+        yield args
+        return
+    start = time.time()
+    try:
+        yield args
+    except BaseException as ex:
+        args.setdefault("error", repr(ex))
+        raise
+    finally:
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (time.time() - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {key: _jsonable(value) for key, value in args.items()},
+        }
+        with _lock:
+            _spans.append(event)
+
+
+def traced(name: str, category: str) -> Callable[[F], F]:
+    """span() around every call of the decorated function."""
+
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not enabled():
+                return function(*args, **kwargs)
+            with span(name, category):
+                return function(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+@atexit.register
+def _write_spans() -> None:
+    trace_dir = os.environ.get(TRACE_ENV)
+    if not trace_dir or not _spans:
+        return
+    path = Path(trace_dir) / f"{os.getpid()}.jsonl"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as handle:
+        for event in _spans:
+            handle.write(json.dumps(event) + "\n")
+    _spans.clear()
+
+
+def load(trace_dir: Path) -> list[dict[str, Any]]:
+    """Every span every process wrote into trace_dir, ours included."""
+    _write_spans()
+    events = []
+    for path in sorted(trace_dir.glob("*.jsonl")):
+        for line in path.read_text(encoding="utf-8").splitlines():
+            if line:
+                events.append(json.loads(line))
+    return events
+
+
+def export_chrome(events: list[dict[str, Any]], path: Path) -> None:
+    """Chrome's trace-event JSON, one row per process and thread."""
+    path.write_text(
+        json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+    )
+
+
+def summarize(events: list[dict[str, Any]]) -> str:
+    """Spans grouped by category and name, the costliest first."""
+    groups: dict[tuple[str, str], list[float]] = {}
+    for event in events:
+        key = (event["cat"], event["name"])
+        groups.setdefault(key, []).append(event["dur"] / 1000)
+    rows = sorted(groups.items(), key=lambda item: -sum(item[1]))
+    width = max((len(f"{cat} {name}") for cat, name in groups), default=4)
+    lines = [
+        f"{'span':<{width}}  {'count':>5}  {'total ms':>10}  {'max ms':>9}"
+    ]
+    for (cat, name), durations in rows:
+        lines.append(
+            f"{cat + ' ' + name:<{width}}  {len(durations):>5}"
+            f"  {sum(durations):>10.1f}  {max(durations):>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Summarize the spans DOTFILES_TRACE collected."
+    )
+    parser.add_argument("trace_dir", type=Path)
+    parser.add_argument(
+        "--chrome", type=Path, help="also write a Chrome trace here"
+    )
+    args = parser.parse_args()
+    events = load(args.trace_dir)
+    if args.chrome:
+        export_chrome(events, args.chrome)
+    print(summarize(events))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,326 @@
+import atexit
+import fcntl
+import json
 import logging
 import os
 import shlex
 import shutil
-import socket
 import subprocess
-import urllib.request
+import sys
+import time
+import urllib.parse
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 from subprocess import CompletedProcess
 from typing import Any
 
 import __main__
 
+# urllib.request, libdotfiles.net (http.client, ssl, email), hashlib and
+# concurrent.futures are imported where they are used: every launcher
+# create_script() writes imports this module, and they would double its start
+from libdotfiles import trace
+from libdotfiles.facts import HostFacts
+
 logger = logging.getLogger(__name__)
 
 LIBDOTFILES_DIR = Path(__file__).parent.absolute()
 REPO_ROOT_DIR = LIBDOTFILES_DIR.parent
 HOME_DIR = Path("~").expanduser()
 PKG_DIR = Path(__main__.__file__).parent
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME") or HOME_DIR / ".cache") / "dotfiles"
+)
+
+STATE_DIR = (
+    Path(os.environ.get("XDG_STATE_HOME") or HOME_DIR / ".local" / "state")
+    / "dotfiles"
+)
+
+# set to keep host facts from being saved between runs
+NO_FACTS_CACHE_ENV = "DOTFILES_NO_FACTS_CACHE"
+
+DOWNLOAD_CHUNK = 64 * 1024
+COMPARE_CHUNK = 1024 * 1024
+# linux/fs.h: share the source's extents, on btrfs, xfs and friends
+FICLONE = 0x40049409
+DOWNLOAD_WORKERS = 4
+MAX_REDIRECTS = 5
+
+# set by libdotfiles.runner when it runs modules side by side
+LOCK_DIR_ENV = "DOTFILES_LOCK_DIR"
+# set by libdotfiles.runner: where to list what this module produced, and
+# what it failed at but carried on past
+OUTPUTS_ENV = "DOTFILES_OUTPUTS"
+# programs that take the package database lock or may prompt for a password,
+# which modules running side by side have to take turns at: the guess for a
+# command whose caller doesn't say whether it changes the system
+EXCLUSIVE_PROGRAMS = {
+    "sudo",
+    "pacman",
+    "pacaur",
+    "makepkg",
+    "apt",
+    "apt-get",
+    "dpkg",
+}
+
+FACTS = HostFacts(
+    None if os.environ.get(NO_FACTS_CACHE_ENV) else CACHE_DIR / "facts.json"
+)
+atexit.register(FACTS.save)
+
+
+def run(
+    command: list[Any], exclusive: bool | None = None, **kwargs: Any
+) -> CompletedProcess[str]:
+    command_line = shlex.join(map(str, command))
+    logger.info("Running %r...", command_line)
+    name = Path(str(command[0])).name if command else ""
+    exclusive = is_exclusive(command, exclusive)
+    with trace.span(name, "run", command=command_line) as record:
+        with exclusive_lock(command, exclusive):
+            result = subprocess.run(command, **kwargs)
+        if exclusive:
+            # it may well have installed a program
+            FACTS.forget_executables()
+        record["returncode"] = result.returncode
+        if isinstance(result.stdout, (str, bytes)):
+            record["bytes"] = len(result.stdout)
+        return result
+
+
+def is_exclusive(command: list[Any], exclusive: bool | None = None) -> bool:
+    """Whether command changes the system, if the caller didn't say.
+
+    Guessed from the program, for the sudo and apt modules run themselves;
+    pip joins in too: two user installs at once trip over each other.
+    """
+    if exclusive is not None:
+        return exclusive
+    words = [str(word) for word in command[:3]]
+    return bool(words) and (
+        Path(words[0]).name in EXCLUSIVE_PROGRAMS
+        or words[1:3] == ["-m", "pip"]
+    )
+
+
+@contextmanager
+def exclusive_lock(
+    command: list[Any], exclusive: bool | None = None
+) -> Iterator[None]:
+    """Hold the runner's lock around a command that can't share the system.
+
+    exclusive says whether command changes the system; see is_exclusive().
+    """
+    lock_dir = os.environ.get(LOCK_DIR_ENV)
+    if not lock_dir or not is_exclusive(command, exclusive):
+        yield
+        return
+    with open(Path(lock_dir) / "system.lock", "w") as handle:
+        with trace.span("system.lock", "lock"):
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+
+
+_outputs: list[dict[str, str]] = []
+_failures: list[str] = []
+
+
+def record_output(kind: str, path: Path, source: Path | None = None) -> None:
+    """Note a file, dir or symlink this module made, for the runner to check.
+
+    libdotfiles.state skips a module whose inputs haven't changed only while
+    everything it recorded is still in place.
+    """
+    entry = {"kind": kind, "path": str(Path(path).absolute())}
+    if source is not None:
+        entry["source"] = str(Path(source).absolute())
+    _outputs.append(entry)
+    FACTS.forget_executables()
 
 
-def run(command: list[Any], **kwargs: Any) -> CompletedProcess[str]:
-    logger.info("Running %r...", shlex.join(map(str, command)))
-    return subprocess.run(command, **kwargs)
+def record_failure(what: str) -> None:
+    """Note something this module couldn't do and carried on without.
+
+    It still exits 0 for the modules after it, but the runner won't count it
+    as done, so the next run tries again rather than skipping it for good.
+    """
+    _failures.append(what)
+
+
+@atexit.register
+def _write_outputs() -> None:
+    if outputs_path := os.environ.get(OUTPUTS_ENV):
+        Path(outputs_path).write_text(
+            json.dumps({"outputs": _outputs, "failures": _failures})
+        )
 
 
 def has_executable(program: str) -> bool:
-    return shutil.which(program) is not None
+    return FACTS.has_executable(program)
 
 
 def download_file(url: str, path: Path, overwrite: bool = False) -> None:
+    """Fetch url into path, atomically, and only if something changed.
+
+    The body streams into a .part file next to path, so a big download never
+    sits in memory, and a download cut short resumes where it stopped on the
+    next run. With overwrite, the validators the last download came with are
+    sent along, so an unchanged file costs one 304 and no body.
+    """
     create_dir(path.parent)
-    if overwrite or not path.exists():
-        logger.info("Downloading %r into %s...", url, path)
+    record_output("file", path)
+    if not overwrite and path.exists():
+        return
+    import urllib.request
+
+    from libdotfiles import net
+
+    logger.info("Downloading %r into %s...", url, path)
+    scheme = urllib.parse.urlsplit(url).scheme
+    with trace.span(path.name, "download", url=url) as record:
+        if scheme in ("http", "https"):
+            record["bytes"] = _download_http(url, path)
+            return
+        # ftp and friends: no validators and no ranges, but still streamed
         request = urllib.request.Request(url)
-        request.add_header("User-Agent", "mozilla")
+        request.add_header("User-Agent", net.USER_AGENT)
         request.add_header("Referer", url)
-        response = urllib.request.urlopen(request)
-        with path.open("wb") as handle:
-            handle.write(response.read())
+        part_path = _part_path(path)
+        with urllib.request.urlopen(
+            request, timeout=net.TIMEOUT
+        ) as response, part_path.open("wb") as handle:
+            shutil.copyfileobj(response, handle, DOWNLOAD_CHUNK)
+            record["bytes"] = handle.tell()
+        os.replace(part_path, path)
+
+
+def download_files(
+    items: list[tuple[str, Path]], overwrite: bool = False
+) -> None:
+    """download_file for several files at once, over the shared pool."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(DOWNLOAD_WORKERS) as executor:
+        futures = [
+            executor.submit(download_file, url, path, overwrite)
+            for url, path in items
+        ]
+    for future in futures:
+        future.result()
+
+
+def _part_path(path: Path) -> Path:
+    return path.with_name(path.name + ".part")
+
+
+def _download_meta_path(path: Path) -> Path:
+    import hashlib
+
+    # not next to the file: plug.vim's directory is nobody's business but vim's
+    key = hashlib.sha256(str(path.absolute()).encode()).hexdigest()[:16]
+    return CACHE_DIR / "downloads" / f"{key}.json"
+
+
+def _download_http(url: str, path: Path) -> int:
+    """Returns how many bytes of body came down the wire."""
+    from libdotfiles import net
+
+    meta_path = _download_meta_path(path)
+    part_path = _part_path(path)
+    try:
+        meta = json.loads(meta_path.read_text())
+        if meta.get("url") != url:
+            meta = {}
+    except (OSError, ValueError):
+        meta = {}
+    validator = meta.get("etag") or meta.get("last_modified")
+
+    headers = {"Referer": url}
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    if offset and meta.get("partial") and validator:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+    elif path.exists() and not meta.get("partial"):
+        offset = 0
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    else:
+        offset = 0
+
+    location = url
+    for _redirect in range(MAX_REDIRECTS):
+        with net.POOL.fetch(location, headers=headers) as response:
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                if not response.getheader("Location"):
+                    raise RuntimeError(f"{location} redirects nowhere")
+                location = urllib.parse.urljoin(
+                    location, response.getheader("Location")
+                )
+                continue
+            if response.status == 304:
+                response.read()
+                logger.info("%s hasn't changed", path)
+                return 0
+            if response.status == 200:
+                offset = 0
+            elif response.status == 416 or (
+                response.status == 206
+                and not (response.getheader("Content-Range") or "").startswith(
+                    f"bytes {offset}-"
+                )
+            ):
+                # the part on disk is no prefix of what's there now, or not
+                # what this sent the rest of: either way, no use
+                logger.warning(
+                    "%s won't send the rest of %s, starting over",
+                    location,
+                    part_path,
+                )
+                part_path.unlink(missing_ok=True)
+                headers = {"Referer": url}
+                offset = 0
+                continue
+            elif response.status != 206:
+                response.read()
+                raise RuntimeError(
+                    f"Downloading {url}: HTTP {response.status}"
+                )
+            meta = {
+                "url": url,
+                "etag": response.getheader("ETag"),
+                "last_modified": response.getheader("Last-Modified"),
+                "partial": True,
+            }
+            meta_path.parent.mkdir(parents=True, exist_ok=True)
+            meta_path.write_text(json.dumps(meta))
+            with part_path.open("r+b" if offset else "wb") as handle:
+                handle.seek(offset)
+                handle.truncate()
+                while chunk := response.read(DOWNLOAD_CHUNK):
+                    handle.write(chunk)
+                received = handle.tell() - offset
+            break
+    else:
+        raise RuntimeError(f"Downloading {url}: too many redirects")
+
+    os.replace(part_path, path)
+    meta["partial"] = False
+    meta_path.write_text(json.dumps(meta))
+    return received
 
 
 def create_file(
     path: Path, content: str | None = None, overwrite: bool = False
 ) -> None:
     create_dir(path.parent)
+    record_output("file", path)
     if overwrite or not os.path.exists(path):
         logger.info("Creating file %s...", path)
         with path.open("w", encoding="utf-8") as handle:
@@ -51,31 +328,38 @@ def create_file(
                 handle.write(content)
 
 
-def create_script(module: str, name: str) -> None:
+def create_script(module: str, name: str, resident: bool = False) -> None:
     """Put an executable on PATH that runs `python3 -m <module>`.
 
     Only ./install puts the repo on sys.path, so the launcher has to carry it
     itself; writing it at install time is what lets the checkout live wherever
-    this machine keeps it.
+    this machine keeps it. resident keeps the module's imports loaded in a
+    server between calls; see libdotfiles.launcher.
     """
+    from libdotfiles import launcher
+
     path = HOME_DIR / ".local" / "bin" / name
     create_dir(path.parent)
     logger.info("Creating script %s...", path)
+    python = shutil.which("python3") or sys.executable
     path.write_text(
-        "#!/bin/sh\n"
-        f"export PYTHONPATH={shlex.quote(str(REPO_ROOT_DIR))}\n"
-        f'exec python3 -m {module} "$@"\n'
+        launcher.source(module, REPO_ROOT_DIR, python, resident=resident)
     )
     path.chmod(0o755)
+    launcher.precompile(module, REPO_ROOT_DIR)
+    record_output("file", path)
 
 
 def create_dir(path: Path) -> None:
+    record_output("dir", path)
     if not path.exists():
         logger.info("Creating directory %s...", path)
-        path.mkdir(parents=True)
+        # download_files() threads may well create the same one at once
+        path.mkdir(parents=True, exist_ok=True)
 
 
 def create_symlink(source: Path, target: Path) -> None:
+    record_output("symlink", target, source)
     if target.exists() and source.samefile(target):
         logger.info("Link %s already links to %s", target, source)
         return
@@ -89,20 +373,220 @@ def create_symlink(source: Path, target: Path) -> None:
     os.symlink(source, target)
 
 
-def create_symlinks_tree(source_dir: Path, target_dir: Path) -> None:
-    for source_path in source_dir.rglob("**/*"):
-        if source_path.is_file():
-            source_rel_path = source_path.relative_to(source_dir)
-            create_symlink(source_path, target_dir / source_rel_path)
+@dataclass
+class TreeSyncStats:
+    created: int = 0
+    removed: int = 0
+    kept: int = 0
+    # directory listings, readlinks, symlinks, unlinks and mkdirs we asked for
+    syscalls: int = 0
+    elapsed: float = 0.0
 
 
-def copy_file(source: Path, target: Path) -> None:
+def create_symlinks_tree(
+    source_dir: Path, target_dir: Path, prune: bool = False
+) -> TreeSyncStats:
+    """Link every file under source_dir to the same place under target_dir.
+
+    Each directory on either side is listed once and the two listings are
+    compared in memory, so a link that is already right costs one readlink
+    instead of the half a dozen stats create_symlink spends on it. With
+    prune, links under target_dir that point into source_dir at files no
+    longer there are removed too: what a file deleted from the repo left.
+    """
+    start = time.perf_counter()
+    stats = TreeSyncStats()
+    source_root = str(source_dir.absolute())
+    record_output("dir", target_dir)
+
+    def listing(path: str) -> dict[str, os.DirEntry[str]] | None:
+        stats.syscalls += 1
+        try:
+            with os.scandir(path) as entries:
+                return {entry.name: entry for entry in entries}
+        except FileNotFoundError:
+            return None
+
+    def prune_links(
+        target: dict[str, os.DirEntry[str]], keep: set[str]
+    ) -> None:
+        for name, entry in target.items():
+            if name in keep:
+                continue
+            if entry.is_symlink():
+                stats.syscalls += 1
+                link = os.readlink(entry.path)
+                if link == source_root or link.startswith(source_root + "/"):
+                    logger.info("Removing stale symlink %s...", entry.path)
+                    stats.syscalls += 1
+                    os.unlink(entry.path)
+                    stats.removed += 1
+            elif entry.is_dir():
+                # a directory the repo dropped may still hold our links
+                prune_links(listing(entry.path) or {}, set())
+
+    def sync(source_path: str, target_path: str) -> None:
+        source = listing(source_path) or {}
+        target = listing(target_path)
+        if target is None:
+            logger.info("Creating directory %s...", target_path)
+            stats.syscalls += 1
+            os.makedirs(target_path)
+            target = {}
+        for name, entry in sorted(source.items()):
+            target_entry = target.get(name)
+            link_path = os.path.join(target_path, name)
+            if entry.is_dir(follow_symlinks=False):
+                if target_entry is not None and target_entry.is_symlink():
+                    logger.info("Removing old symlink %s...", link_path)
+                    stats.syscalls += 1
+                    os.unlink(link_path)
+                    stats.removed += 1
+                    target.pop(name)
+                sync(entry.path, link_path)
+                continue
+            if not entry.is_file():
+                continue  # a dangling link in the repo links to nothing
+            # kept or made, either way it's this module's to verify
+            record_output("symlink", Path(link_path), Path(entry.path))
+            if target_entry is not None:
+                if not target_entry.is_symlink():
+                    raise RuntimeError(
+                        f"Target file {link_path} exists and is not a symlink."
+                    )
+                stats.syscalls += 1
+                if os.readlink(link_path) == entry.path:
+                    stats.kept += 1
+                    continue
+                logger.info("Removing old symlink %s...", link_path)
+                stats.syscalls += 1
+                os.unlink(link_path)
+                stats.removed += 1
+            logger.info("Linking %s to %s...", entry.path, link_path)
+            stats.syscalls += 1
+            os.symlink(entry.path, link_path)
+            stats.created += 1
+        if prune:
+            prune_links(target, set(source))
+
+    sync(source_root, str(target_dir.absolute()))
+    stats.elapsed = time.perf_counter() - start
+    logger.info(
+        "Synced %s into %s: %d linked, %d removed, %d already linked, "
+        "%d syscalls in %.1f ms",
+        source_dir,
+        target_dir,
+        stats.created,
+        stats.removed,
+        stats.kept,
+        stats.syscalls,
+        stats.elapsed * 1000,
+    )
+    return stats
+
+
+def copy_file(
+    source: Path, target: Path, verify: bool = False, preserve: bool = False
+) -> None:
+    """Copy source over target, unless target already holds the same bytes.
+
+    A copy takes the source's mtime, so on the next run equal sizes and
+    mtimes are enough to skip it; verify compares the bytes even then. A
+    target with the same bytes but another mtime is only touched, so that
+    nothing watching it reloads for nothing. The bytes go kernel-side into a
+    temporary file that replaces target, so a reader never sees half of it.
+    preserve copies the permission bits and the rest of the metadata too.
+    """
     _remove_symlink(target)
-    if target.exists() and not target.is_file():
-        raise RuntimeError(f"Target file {target} exists and is not a file.")
+    record_output("file", target)
+    source_stat = source.stat()
+    try:
+        target_stat: os.stat_result | None = target.stat()
+    except FileNotFoundError:
+        target_stat = None
+    if target_stat is not None:
+        if not target.is_file():
+            raise RuntimeError(
+                f"Target file {target} exists and is not a file."
+            )
+        same_mtime = target_stat.st_mtime_ns == source_stat.st_mtime_ns
+        if target_stat.st_size == source_stat.st_size and (
+            same_mtime and not verify or _same_contents(source, target)
+        ):
+            logger.info("File %s is already up to date", target)
+            if not same_mtime:
+                os.utime(target, ns=_stat_times(source_stat))
+            if preserve:
+                shutil.copystat(source, target)
+            return
+
     logger.info("Copying %s to %s...", source, target)
     target.parent.mkdir(parents=True, exist_ok=True)
-    target.write_bytes(source.read_bytes())
+    temp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    temp_path.unlink(missing_ok=True)
+    try:
+        # O_EXCL with 0o666 lets the umask decide, as write_bytes would have
+        with source.open("rb") as source_handle, open(
+            os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666),
+            "wb",
+        ) as target_handle:
+            _copy_contents(source_handle.fileno(), target_handle.fileno())
+        if preserve:
+            shutil.copystat(source, temp_path)
+        elif target_stat is not None:
+            os.chmod(temp_path, target_stat.st_mode & 0o7777)
+        os.utime(temp_path, ns=_stat_times(source_stat))
+        os.replace(temp_path, target)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+def _stat_times(stat: os.stat_result) -> tuple[int, int]:
+    return stat.st_atime_ns, stat.st_mtime_ns
+
+
+def _same_contents(first: Path, second: Path) -> bool:
+    with first.open("rb") as first_handle, second.open("rb") as second_handle:
+        while True:
+            first_chunk = first_handle.read(COMPARE_CHUNK)
+            if first_chunk != second_handle.read(COMPARE_CHUNK):
+                return False
+            if not first_chunk:
+                return True
+
+
+def _copy_contents(source_fd: int, target_fd: int) -> None:
+    """Copy without the bytes ever reaching Python, whatever the kernel has.
+
+    A reflink shares the blocks outright; copy_file_range copies inside the
+    kernel, server-side on NFS; sendfile is what older kernels and crossing
+    filesystems leave.
+    """
+    try:
+        fcntl.ioctl(target_fd, FICLONE, source_fd)
+        return
+    except OSError:
+        pass
+    size = os.fstat(source_fd).st_size
+    offset = 0
+    try:
+        while offset < size:
+            # 0 before the end is a filesystem that won't, not the end
+            copied = os.copy_file_range(source_fd, target_fd, size - offset)
+            if not copied:
+                break
+            offset += copied
+    except OSError:
+        if offset:
+            raise
+    # sendfile writes at target_fd's position, which is wherever
+    # copy_file_range left it
+    while offset < size:
+        copied = os.sendfile(target_fd, source_fd, offset, size - offset)
+        if not copied:
+            raise RuntimeError(f"Copied {offset} of {size} bytes, then EOF")
+        offset += copied
 
 
 def create_symlinks(items: list[tuple[Path, Path]]) -> None:
@@ -117,44 +601,117 @@ def _remove_symlink(path: Path) -> None:
 
 
 def get_distro_name() -> str:
-    for line in Path("/etc/os-release").read_text().splitlines():
-        key, value = line.split("=", 1)
-        key = key.lower()
-        if key == "id":
-            return value.strip('"')
-    return "unknown"
+    return FACTS.distro
 
 
 def get_hostname() -> str:
-    return socket.gethostname()
+    return FACTS.hostname
 
 
 def get_current_username() -> str:
-    return run(
-        ["whoami"], check=True, capture_output=True, text=True
-    ).stdout.strip()
+    return FACTS.username
+
 
+def git_clone(
+    repo: str,
+    path: str | Path,
+    depth: int | None = None,
+    filter_spec: str | None = None,
+    update: bool = False,
+) -> None:
+    """Clone repo into path, or make sure path already is a clone of it.
 
-def git_clone(repo: str, path: str | Path) -> None:
+    depth makes a shallow clone, and filter_spec a partial one: with
+    "blob:none" file contents come down only as a checkout needs them. With
+    update, an existing clone is fast-forwarded to the remote's HEAD, but
+    only once `git ls-remote` says that moved, which costs a round trip and
+    no fetch.
+    """
     target_path = Path(path).absolute()
-    if target_path.exists():
-        if not (target_path / ".git").exists():
-            logger.error(
-                "Target directory %s already exists and is not a git repository.",
-                target_path,
-            )
-        remote_url = run(
-            ["git", "-C", target_path, "remote", "get-url", "origin"],
-            check=True,
-            capture_output=True,
-            text=True,
-        ).stdout.strip()
-        if remote_url.removesuffix(".git") != repo.removesuffix(".git"):
-            logger.error(
-                "Target repository %s points to %s, expected %s.",
-                target_path,
-                remote_url,
-                repo,
-            )
+    record_output("dir", target_path)
+    if not target_path.exists():
+        command: list[Any] = ["git", "clone"]
+        if depth is not None:
+            command += ["--depth", str(depth)]
+        if filter_spec is not None:
+            command += ["--filter", filter_spec]
+        run([*command, repo, target_path], check=True)
         return
-    run(["git", "clone", repo, target_path], check=True)
+    if not (target_path / ".git").exists():
+        logger.error(
+            "Target directory %s already exists and is not a git repository.",
+            target_path,
+        )
+        return
+    remote_url = run(
+        ["git", "-C", target_path, "remote", "get-url", "origin"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    if remote_url.removesuffix(".git") != repo.removesuffix(".git"):
+        logger.error(
+            "Target repository %s points to %s, expected %s.",
+            target_path,
+            remote_url,
+            repo,
+        )
+        return
+    if update:
+        _git_fast_forward(target_path)
+
+
+def _git_fast_forward(path: Path) -> None:
+    remote_head = run(
+        ["git", "-C", path, "ls-remote", "--symref", "origin", "HEAD"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    remote_ref = remote_sha = None
+    for line in remote_head.splitlines():
+        value, _, name = line.partition("\t")
+        if name != "HEAD":
+            continue
+        if value.startswith("ref: "):
+            remote_ref = value.removeprefix("ref: ")
+        else:
+            remote_sha = value
+    local_sha, local_ref = run(
+        [
+            "git",
+            "-C",
+            path,
+            "rev-parse",
+            "HEAD",
+            "--symbolic-full-name",
+            "HEAD",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    if remote_sha is None or remote_sha == local_sha:
+        logger.info("Repository %s is up to date", path)
+        return
+    if remote_ref is not None and remote_ref != local_ref:
+        logger.warning(
+            "Repository %s is on %s, not %s; not updating it",
+            path,
+            local_ref,
+            remote_ref,
+        )
+        return
+    # a plain fetch into a shallow clone fills in just the new commits, down
+    # to what it has, so the fast-forward below still finds its base
+    run(
+        ["git", "-C", path, "fetch", "origin", remote_ref or "HEAD"],
+        check=True,
+    )
+    if run(
+        ["git", "-C", path, "merge", "--ff-only", "FETCH_HEAD"], check=False
+    ).returncode:
+        logger.warning(
+            "Repository %s has diverged from its remote; not updating it",
+            path,
+        )